@@ -10,6 +10,28 @@ PATHEX = [ROOT, os.path.join(ROOT, "src")]
 # Logo padrão embutido ao lado do executável
 DATAS = [(os.path.join(ROOT, "Logo.jpg"), ".")]
 
+# Módulos que o aplicativo não usa: menos arquivos para carregar na abertura
+EXCLUDES = [
+    "numpy",
+    "pandas",
+    "matplotlib",
+    "scipy",
+    "IPython",
+    "jupyter_client",
+    "notebook",
+    "pytest",
+    "pydoc",
+    "doctest",
+    "lib2to3",
+    "xmlrpc",
+    "tkinter.test",
+    "PIL.ImageQt",
+    "PIL.ImageTk",
+    "PyQt5",
+    "PySide2",
+    "PySide6",
+]
+
 block_cipher = None
 
 a = Analysis(
@@ -17,11 +39,12 @@ a = Analysis(
     pathex=PATHEX,
     binaries=[],
     datas=DATAS,
-    hiddenimports=[],
+    # tkcalendar é importado sob demanda; o babel.numbers dele não é detectado sozinho
+    hiddenimports=["babel.numbers"],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=EXCLUDES,
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -30,20 +53,19 @@ a = Analysis(
 
 pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
 
+# onedir (EXE + COLLECT): sem extrair o pacote em pasta temporária a cada
+# abertura, como acontece no onefile; UPX desativado pelo mesmo motivo
+# (descompressão das DLLs na inicialização). Distribuir a pasta dist/CarimboPDF.
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.zipfiles,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='CarimboPDF',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
+    upx=False,
     console=False,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -52,3 +74,14 @@ exe = EXE(
     entitlements_file=None,
     icon=None,
 )
+
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.zipfiles,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='CarimboPDF',
+)
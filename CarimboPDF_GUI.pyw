@@ -4,6 +4,7 @@ Script para executar o CarimboPDF em modo GUI sem console.
 Use este arquivo para executar a aplicação sem mostrar o terminal.
 """
 
+import multiprocessing
 import sys
 import os
 from pathlib import Path
@@ -19,4 +20,6 @@ os.environ["PYTHONPATH"] = str(src_path)
 from data_hora_pdf.cli import main
 
 if __name__ == "__main__":
+    # Necessário para o modo em lote (processos) no executável PyInstaller
+    multiprocessing.freeze_support()
     sys.exit(main())
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from data_hora_pdf.stamper import StampOptions, protect_pdf
+
+
+def bench(path: str, repeat: int = 5) -> None:
+    # Custo de protect_pdf por MB de entrada para cada método de encriptação
+    size_mb = Path(path).stat().st_size / (1024 * 1024)
+    methods = {
+        "RC4-128": StampOptions(restrict_editing=True),
+        "AES-256": StampOptions(restrict_editing=True, encrypt_content=True),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        out = str(Path(tmp) / "protegido.pdf")
+        for label, opts in methods.items():
+            protect_pdf(path, out, opts)  # aquecimento
+            started = time.perf_counter()
+            for _ in range(repeat):
+                protect_pdf(path, out, opts)
+            elapsed = (time.perf_counter() - started) / repeat
+            print(f"{label}: {elapsed * 1000:.1f} ms/arquivo | {elapsed * 1000 / size_mb:.1f} ms/MB ({size_mb:.2f} MB)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python scripts/bench_protection.py arquivo.pdf [repetições]")
+        raise SystemExit(2)
+    bench(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 5)
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import sys
+import tempfile
+from datetime import date
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+from data_hora_pdf.credentials import PasswordEntry, PasswordMap
+from data_hora_pdf.stamper import StampOptions, stamp_pdf
+
+# Conferências de casos que já quebraram o carimbo; cada uma devolve a
+# lista de problemas encontrados (vazia = ok).
+
+CIDADE = "Maringá"
+DATA = date(2024, 5, 17)
+FONTE_TTF = Path("/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf")
+
+
+def _make_logo(path: Path) -> None:
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 32), False)
+    pix.set_rect(pix.irect, (200, 30, 30))
+    pix.save(str(path))
+
+
+def _make_unbalanced_pdf(path: Path) -> None:
+    # Conteúdo que muda a matriz (cm) sem q/Q: tudo que vier depois herda a escala
+    doc = fitz.open()
+    page = doc.new_page(width=595.276, height=841.89)
+    xref = doc.get_new_xref()
+    doc.update_object(xref, "<<>>")
+    doc.update_stream(xref, b"0.5 0 0 0.5 0 0 cm\n0 0 1 rg 10 10 50 50 re f\n")
+    doc.xref_set_key(page.xref, "Contents", f"{xref} 0 R")
+    doc.save(str(path))
+    doc.close()
+
+
+def _near(a, b, tol: float = 1.0) -> bool:
+    return all(abs(p - q) <= tol for p, q in zip(a, b))
+
+
+def check_compact_unbalanced(tmp: Path) -> list[str]:
+    """Modo compacto em página com conteúdo desbalanceado: carimbo no lugar e tamanho certos."""
+    problems: list[str] = []
+    source = tmp / "desbalanceado.pdf"
+    logo = tmp / "logo.png"
+    _make_unbalanced_pdf(source)
+    _make_logo(logo)
+    for compact in (False, True):
+        out = tmp / f"saida_{'compacto' if compact else 'comum'}.pdf"
+        opts = StampOptions(x=300, y=250, logo_path=str(logo), compact=compact)
+        result = stamp_pdf(str(source), str(out), CIDADE, DATA, opts)
+        label = "compacto" if compact else "comum"
+        with fitz.open(str(out)) as doc:
+            page = doc[0]
+            words = [w for w in page.get_text("words") if w[4].upper().startswith(CIDADE.upper())]
+            if not words or not fitz.Rect(result.text_rect).intersects(fitz.Rect(words[0][:4])):
+                problems.append(f"{label}: texto fora de {result.text_rect}: {[w[:4] for w in words]}")
+            images = [info for info in page.get_image_info() if info["width"] == 64]
+            if not images or not _near(images[0]["bbox"], result.logo_rect):
+                problems.append(f"{label}: logo em {[i['bbox'] for i in images]}, esperado {result.logo_rect}")
+    return problems
+
+
+def check_replace_keeps_document(tmp: Path) -> list[str]:
+    """Substituições seguidas: texto do documento sob o carimbo intacto e um só logo."""
+    problems: list[str] = []
+    logo = tmp / "logo.png"
+    _make_logo(logo)
+    for compact in (False, True):
+        label = "compacto" if compact else "comum"
+        source = tmp / f"documento_{label}.pdf"
+        doc = fitz.open()
+        doc.new_page().insert_text((320, 245), "TEXTO DO DOCUMENTO", fontsize=9)
+        doc.save(str(source))
+        doc.close()
+        opts = StampOptions(x=300, y=250, logo_path=str(logo), if_stamped="replace", compact=compact)
+        for day in range(1, 4):
+            stamp_pdf(str(source), str(source), CIDADE, DATA.replace(day=day), opts)
+            with fitz.open(str(source)) as doc:
+                page = doc[0]
+                text = page.get_text()
+                images = len(page.get_images())
+            if "TEXTO DO DOCUMENTO" not in text:
+                problems.append(f"{label}: texto do documento apagado na substituição {day}")
+            if text.count(CIDADE.upper()) != 1:
+                problems.append(f"{label}: {text.count(CIDADE.upper())} carimbos após a substituição {day}")
+            if images != 1:
+                problems.append(f"{label}: {images} imagens após a substituição {day}")
+    return problems
+
+
+def _embedded_font_files(doc: fitz.Document) -> dict[str, int]:
+    # Nome da fonte -> tamanho do arquivo de fonte embutido (decodificado)
+    found: dict[str, int] = {}
+    for xref in range(1, doc.xref_length()):
+        for key in ("FontFile", "FontFile2", "FontFile3"):
+            kind, value = doc.xref_get_key(xref, key)
+            if kind == "xref":
+                found[doc.xref_get_key(xref, "FontName")[1]] = len(doc.xref_stream(int(value.split()[0])) or b"")
+    return found
+
+
+def check_font_file_keeps_document_fonts(tmp: Path) -> list[str]:
+    """Carimbo com --font-file: só a fonte do carimbo é reduzida, as do documento ficam inteiras."""
+    if not FONTE_TTF.exists():
+        return []
+    problems: list[str] = []
+    source = tmp / "fontes.pdf"
+    doc = fitz.open()
+    for _ in range(2):
+        page = doc.new_page()
+        page.insert_font(fontname="F1", fontfile=str(FONTE_TTF))
+        page.insert_text((72, 72), "TEXTO DO DOCUMENTO", fontname="F1", fontsize=11)
+    doc.save(str(source))
+    with fitz.open(str(source)) as doc:
+        before = _embedded_font_files(doc)
+    for compact in (False, True):
+        label = "compacto" if compact else "comum"
+        out = tmp / f"fontes_{label}.pdf"
+        opts = StampOptions(x=300, y=250, font_file=str(FONTE_TTF), if_stamped="replace", compact=compact)
+        stamp_pdf(str(source), str(out), CIDADE, DATA, opts)
+        stamp_pdf(str(out), str(out), CIDADE, DATA.replace(day=1), opts)
+        with fitz.open(str(out)) as doc:
+            after = _embedded_font_files(doc)
+            text = doc[0].get_text()
+        for name, size in before.items():
+            if after.get(name) != size:
+                problems.append(f"{label}: fonte do documento {name} alterada ({size} -> {after.get(name)} bytes)")
+        subsets = [name for name in after if name not in before]
+        if len(subsets) != 1 or "+" not in subsets[0]:
+            problems.append(f"{label}: fonte do carimbo sem subconjunto único: {subsets}")
+        if text.count(CIDADE.upper()) != 1 or "TEXTO DO DOCUMENTO" not in text:
+            problems.append(f"{label}: texto após a substituição: {text!r}")
+    return problems
+
+
+def check_font_file_cropbox_position(tmp: Path) -> list[str]:
+    """Página com CropBox diferente da MediaBox: --font-file no mesmo lugar da fonte padrão."""
+    if not FONTE_TTF.exists():
+        return []
+    problems: list[str] = []
+    for cropbox in ((0, 0, 595, 700), (0, 100, 595, 842), (30, 30, 580, 800)):
+        for rotation in (0, 90):
+            label = f"CropBox {cropbox}, rotação {rotation}"
+            source = tmp / "cropbox.pdf"
+            doc = fitz.open()
+            page = doc.new_page(width=595, height=842)
+            page.set_cropbox(fitz.Rect(cropbox))
+            page.set_rotation(rotation)
+            doc.save(str(source))
+            doc.close()
+            found = []
+            for font_file in (None, str(FONTE_TTF)):
+                out = tmp / "cropbox_saida.pdf"
+                opts = StampOptions(x=100, y=200, font_file=font_file, if_stamped="skip")
+                stamp_pdf(str(source), str(out), CIDADE, DATA, opts)
+                with fitz.open(str(out)) as doc:
+                    words = [w[:4] for w in doc[0].get_text("words") if w[4].upper().startswith(CIDADE.upper())]
+                found.append(words[0] if words else None)
+                # Recarimbar com skip precisa achar o carimbo onde ele está
+                if stamp_pdf(str(out), str(out), CIDADE, DATA, opts).status != "skipped":
+                    problems.append(f"{label}: carimbo com font_file={font_file} não detectado")
+            base14, font_file = found
+            if base14 is None or font_file is None or not _near(base14[:1] + base14[3:], font_file[:1] + font_file[3:], 3.0):
+                problems.append(f"{label}: --font-file em {font_file}, fonte padrão em {base14}")
+    return problems
+
+
+def check_flat_png_logo_size(tmp: Path) -> list[str]:
+    """Logo chapado (caminho PNG) não pode pesar mais na saída que um logo fotográfico (JPEG)."""
+    from PIL import Image  # type: ignore
+
+    problems: list[str] = []
+    source = tmp / "logo_base.pdf"
+    doc = fitz.open()
+    doc.new_page()
+    doc.save(str(source))
+    doc.close()
+    flat = Image.new("RGB", (3000, 3000), "white")
+    flat.paste((200, 30, 30), (300, 300, 2700, 2700))
+    flat.save(tmp / "chapado.png")
+    # Degradê: muitas cores, vai para JPEG
+    gradient = Image.linear_gradient("L").resize((3000, 3000))
+    photo = Image.merge("RGB", (gradient, gradient.rotate(90), gradient.rotate(45)))
+    photo.save(tmp / "foto.jpg", quality=90)
+    for dpi in (300, 0):
+        sizes = {}
+        for name in ("chapado.png", "foto.jpg"):
+            out = tmp / f"logo_{name}_{dpi}.pdf"
+            stamp_pdf(str(source), str(out), CIDADE, DATA, StampOptions(logo_path=str(tmp / name), logo_dpi=dpi))
+            sizes[name] = out.stat().st_size
+        if sizes["chapado.png"] > sizes["foto.jpg"]:
+            problems.append(f"logo_dpi={dpi}: PNG chapado {sizes['chapado.png']} bytes, JPEG {sizes['foto.jpg']} bytes")
+    return problems
+
+
+def check_password_map_nested(tmp: Path) -> list[str]:
+    """Padrões do mapa de senhas: "*" não desce para subpastas, "**" vale por qualquer profundidade."""
+    passwords = PasswordMap(
+        [
+            PasswordEntry(password="sub", pattern="sub/*.pdf"),
+            PasswordEntry(password="contratos", pattern="contratos/**/*.pdf"),
+            PasswordEntry(password="raiz", pattern="/srv/lote/*.pdf"),
+            PasswordEntry(password="nome", pattern="nota_*.pdf"),
+        ]
+    )
+    expected = {
+        "pm/sub/a.pdf": "sub",
+        "/dados/pm/sub/a.pdf": "sub",
+        "pm/sub/deep/b.pdf": None,
+        "sub/deep/b.pdf": None,
+        "xsub/a.pdf": None,
+        "contratos/a.pdf": "contratos",
+        "pm/contratos/2024/maio/a.pdf": "contratos",
+        "contratos2/a.pdf": None,
+        "/srv/lote/a.pdf": "raiz",
+        "/srv/lote/sub2/a.pdf": None,
+        "/outro/srv/lote/a.pdf": None,
+        "qualquer/pasta/nota_1.pdf": "nome",
+    }
+    problems: list[str] = []
+    for path, password in expected.items():
+        found = passwords.password_for(path)
+        if found != password:
+            problems.append(f"{path}: senha {found!r}, esperado {password!r}")
+    return problems
+
+
+CHECKS = [
+    check_compact_unbalanced,
+    check_replace_keeps_document,
+    check_font_file_keeps_document_fonts,
+    check_font_file_cropbox_position,
+    check_flat_png_logo_size,
+    check_password_map_nested,
+]
+
+
+if __name__ == "__main__":
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for check in CHECKS:
+            problems = check(Path(tmp))
+            failed = failed or bool(problems)
+            print(f"{'FALHOU' if problems else 'ok'}: {check.__name__}")
+            for problem in problems:
+                print(f"  - {problem}")
+    sys.exit(1 if failed else 0)
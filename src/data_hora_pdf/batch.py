@@ -0,0 +1,393 @@
+from __future__ import annotations
+
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, as_completed, wait
+from dataclasses import asdict, dataclass, field, fields, replace
+from datetime import date, datetime
+from functools import partial
+from pathlib import Path
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
+
+from .concurrency import AdaptiveConcurrency
+from .credentials import PasswordMap
+from .ingest import IMAGE_SUFFIXES, is_image_input, pdf_output_path
+from .profiling import ProfileSettings, run_with_profile
+from .stamper import EncryptedInputError, ProtectionError, StampOptions, detect_stamp, plan_stamp, protect_pdf, stamp_pdf
+
+if TYPE_CHECKING:
+    from .metrics import BatchMetrics
+
+try:
+    import psutil  # type: ignore
+except ImportError:
+    psutil = None
+
+
+@dataclass
+class BatchJob:
+    input_pdf: str
+    output_pdf: str
+    cidade: str = ""
+    d: date | None = None
+    options: StampOptions = field(default_factory=StampOptions)
+
+
+@dataclass
+class JobResult:
+    input_pdf: str
+    output_pdf: str
+    status: str  # "stamped" | "skipped" | "protected" | "failed"
+    error: str | None = None
+    reason: str | None = None  # motivo da falha: missing_page, missing_input, encrypted_input, protection_error, missing_password (fila), error
+    elapsed: float = 0.0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    timings: dict[str, float] = field(default_factory=dict)
+    events: list[str] = field(default_factory=list)
+    worker_pid: int = 0
+    rss_bytes: int = 0
+    profile: str | None = None  # artefato de perfil (.profile.json), quando capturado
+    thumbnail: bytes | None = None  # miniatura de conferência (PNG), com options.thumbnail_px
+
+
+def _parse_date(raw: str, allow_future: bool = False) -> date:
+    d = datetime.strptime(raw, "%d/%m/%Y").date()
+    if d > date.today() and not allow_future:
+        raise ValueError(f"A data não pode ser futura: {raw}")
+    return d
+
+
+def load_manifest(path: str, base: BatchJob, allow_future: bool = False) -> list[BatchJob]:
+    """Lê um manifesto JSON Lines: um trabalho por linha.
+
+    Cada linha tem "input" e "output" (ou "in_place": true) e, opcionalmente,
+    "cidade", "date" (DD/MM/AAAA) e qualquer campo de StampOptions, que
+    sobrescreve o valor de base.options. allow_future aceita datas futuras
+    (o planejamento as relata por trabalho em vez de rejeitar o manifesto).
+    """
+    option_names = {f.name for f in fields(StampOptions)}
+    jobs: list[BatchJob] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, raw in enumerate(f, start=1):
+            raw = raw.strip()
+            if not raw or raw.startswith("#"):
+                continue
+            try:
+                entry = json.loads(raw)
+                input_pdf = entry["input"]
+            except (ValueError, KeyError) as e:
+                raise ValueError(f"Manifesto {path}, linha {lineno}: entrada inválida ({e})") from e
+            output_pdf = entry.get("output")
+            if entry.get("in_place"):
+                output_pdf = pdf_output_path(input_pdf) if is_image_input(input_pdf) else input_pdf
+            if not output_pdf:
+                raise ValueError(f"Manifesto {path}, linha {lineno}: informe \"output\" ou \"in_place\"")
+            overrides = {k: v for k, v in entry.items() if k in option_names}
+            jobs.append(
+                BatchJob(
+                    input_pdf=input_pdf,
+                    output_pdf=output_pdf,
+                    cidade=entry.get("cidade", base.cidade),
+                    d=_parse_date(entry["date"], allow_future) if entry.get("date") else base.d,
+                    options=replace(base.options, **overrides),
+                )
+            )
+    return jobs
+
+
+def _is_stamped_product(pdf: Path, image: Path, options: StampOptions) -> bool:
+    """PDF gerado pelo carimbo a partir desta imagem (o marcador registra a origem)."""
+    try:
+        marker = detect_stamp(str(pdf), options)
+    except Exception:
+        return False
+    return marker is not None and marker.source_image == image.name
+
+
+def jobs_from_directory(input_dir: str, output_dir: str | None, base: BatchJob) -> list[BatchJob]:
+    """Um trabalho por PDF ou imagem digitalizada do diretório (recursivo).
+
+    Sem output_dir grava no próprio PDF; imagens sempre geram um .pdf de mesmo
+    nome. Um scan.pdf carimbado ao lado de scan.jpg é o produto de uma
+    execução anterior: no próprio diretório ambos são pulados (repetir a
+    execução não muda nada) e, com output_dir, a imagem é convertida de novo
+    e o produto antigo é ignorado. Um scan.pdf que não veio do carimbo é
+    conflito: a imagem é pulada com aviso.
+    """
+    root = Path(input_dir)
+    jobs: list[BatchJob] = []
+    suffixes = (".pdf",) + IMAGE_SUFFIXES
+    sources = sorted(p for p in root.rglob("*") if p.suffix.lower() in suffixes and p.is_file())
+    pdfs = {src for src in sources if src.suffix.lower() == ".pdf"}
+    products: set[Path] = set()
+    claimed: set[Path] = set()
+    images: list[Path] = []
+    for src in sources:
+        if not is_image_input(str(src)):
+            continue
+        pdf_src = Path(pdf_output_path(str(src)))
+        if pdf_src in claimed:
+            print(f"[data-hora-pdf] Aviso: {src} ignorado: outra imagem já gera {pdf_src.name}")
+            continue
+        claimed.add(pdf_src)
+        if pdf_src in pdfs:
+            if not _is_stamped_product(pdf_src, src, base.options):
+                print(f"[data-hora-pdf] Aviso: {src} ignorado: {pdf_src.name} já existe e não foi gerado pelo carimbo")
+                continue
+            products.add(pdf_src)
+            if not output_dir:
+                continue
+        images.append(src)
+    for src in sources:
+        if src in products or (is_image_input(str(src)) and src not in images):
+            continue
+        dst = Path(output_dir) / src.relative_to(root) if output_dir else src
+        if is_image_input(str(src)):
+            dst = Path(pdf_output_path(str(dst)))
+        jobs.append(replace(base, input_pdf=str(src), output_pdf=str(dst)))
+    return jobs
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _current_rss() -> int:
+    """Memória residente do processo atual em bytes (0 se indisponível)."""
+    if psutil is not None:
+        try:
+            return int(psutil.Process().memory_info().rss)
+        except Exception:
+            pass
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def _failure_reason(exc: Exception) -> str:
+    if isinstance(exc, IndexError):
+        return "missing_page"
+    if isinstance(exc, FileNotFoundError):
+        return "missing_input"
+    if isinstance(exc, ProtectionError):
+        return "protection_error"
+    if isinstance(exc, EncryptedInputError):
+        return "encrypted_input"
+    return "error"
+
+
+def _fail(result: JobResult, exc: Exception) -> None:
+    result.status = "failed"
+    result.error = f"{type(exc).__name__}: {exc}"
+    result.reason = _failure_reason(exc)
+
+
+def _finish(result: JobResult, started: float) -> JobResult:
+    result.elapsed = time.perf_counter() - started
+    result.worker_pid = os.getpid()
+    result.rss_bytes = _current_rss()
+    return result
+
+
+def _write_bytes(path: str, data: bytes) -> None:
+    # Arquivo temporário + rename atômico (também cobre saída = entrada)
+    target = Path(path)
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.part")
+    try:
+        tmp.write_bytes(data)
+        os.replace(tmp, target)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def _with_password(job: BatchJob, passwords: PasswordMap | None) -> BatchJob:
+    # Senha do manifesto tem prioridade sobre o mapa de senhas
+    if passwords is None or job.options.input_password:
+        return job
+    password = passwords.password_for(job.input_pdf)
+    if password is None:
+        return job
+    return replace(job, options=replace(job.options, input_password=password))
+
+
+def run_stamp_job(
+    job: BatchJob,
+    profile: ProfileSettings | None = None,
+    artifact_for: str | None = None,
+    passwords: PasswordMap | None = None,
+) -> JobResult:
+    """Carimba um trabalho; com profile, captura o perfil se ele for lento ou amostrado.
+
+    artifact_for nomeia os artefatos de perfil quando job.output_pdf é um
+    arquivo temporário (fila distribuída). passwords fornece a senha de
+    entradas encriptadas que não a trazem no manifesto.
+    """
+    started = time.perf_counter()
+    result = JobResult(job.input_pdf, job.output_pdf, status="failed", bytes_in=_file_size(job.input_pdf))
+    try:
+        job = _with_password(job, passwords)
+        Path(job.output_pdf).parent.mkdir(parents=True, exist_ok=True)
+        stamped, result.profile = run_with_profile(
+            profile,
+            job.input_pdf,
+            job.output_pdf,
+            job.options,
+            lambda src, dst, opts: stamp_pdf(src, dst, job.cidade, job.d, opts),
+            artifact_for=artifact_for,
+        )
+        result.status = stamped.status
+        result.timings = stamped.timings
+        result.events = stamped.events
+        result.thumbnail = stamped.thumbnail
+        if stamped.status != "skipped":
+            result.bytes_out = _file_size(job.output_pdf)
+    except Exception as e:
+        _fail(result, e)
+    return _finish(result, started)
+
+
+def run_protect_job(
+    job: BatchJob,
+    profile: ProfileSettings | None = None,
+    artifact_for: str | None = None,
+    passwords: PasswordMap | None = None,
+) -> JobResult:
+    started = time.perf_counter()
+    result = JobResult(job.input_pdf, job.output_pdf, status="failed", bytes_in=_file_size(job.input_pdf))
+    try:
+        job = _with_password(job, passwords)
+        Path(job.output_pdf).parent.mkdir(parents=True, exist_ok=True)
+        _none, result.profile = run_with_profile(profile, job.input_pdf, job.output_pdf, job.options, protect_pdf, artifact_for=artifact_for)
+        result.status = "protected"
+        result.bytes_out = _file_size(job.output_pdf)
+    except Exception as e:
+        _fail(result, e)
+    return _finish(result, started)
+
+
+def run_batch(
+    jobs: Iterable[BatchJob],
+    worker: Callable[[BatchJob], JobResult] = run_stamp_job,
+    max_workers: int | None = None,
+    metrics: BatchMetrics | None = None,
+    adaptive: AdaptiveConcurrency | None = None,
+) -> Iterator[JobResult]:
+    """Executa os trabalhos em paralelo (processos) e devolve os resultados à medida que terminam.
+
+    Com adaptive, o número de trabalhos simultâneos é ajustado durante o
+    lote (max_workers é ignorado; o pool tem adaptive.ceiling processos).
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return
+    pending = len(jobs)
+    if metrics is not None:
+        metrics.set_queue_depth(pending)
+    if adaptive is not None:
+        max_workers = min(adaptive.ceiling, len(jobs))
+    else:
+        max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(jobs)))
+    if max_workers == 1:
+        results: Iterable[JobResult] = (worker(job) for job in jobs)
+    elif adaptive is not None:
+        pool = ProcessPoolExecutor(max_workers=max_workers)
+        results = _run_adaptive(pool, jobs, worker, adaptive, metrics)
+    else:
+        pool = ProcessPoolExecutor(max_workers=max_workers)
+        futures = [pool.submit(worker, job) for job in jobs]
+        results = (future.result() for future in as_completed(futures))
+    try:
+        for result in results:
+            pending -= 1
+            if metrics is not None:
+                metrics.set_queue_depth(pending)
+                metrics.observe(result)
+            yield result
+    finally:
+        if max_workers > 1:
+            pool.shutdown(cancel_futures=True)
+        if metrics is not None:
+            metrics.flush(force=True)
+
+
+def _run_adaptive(
+    pool: ProcessPoolExecutor,
+    jobs: list[BatchJob],
+    worker: Callable[[BatchJob], JobResult],
+    adaptive: AdaptiveConcurrency,
+    metrics: BatchMetrics | None,
+) -> Iterator[JobResult]:
+    # Só adaptive.limit trabalhos ficam no pool; o restante aguarda aqui
+    queued = iter(jobs)
+    inflight: set[Future] = set()
+    exhausted = False
+    while True:
+        while not exhausted and len(inflight) < adaptive.limit:
+            job = next(queued, None)
+            if job is None:
+                exhausted = True
+                break
+            inflight.add(pool.submit(worker, job))
+        if metrics is not None:
+            metrics.set_concurrency(adaptive.limit)
+        if not inflight:
+            return
+        finished, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+        for future in finished:
+            result = future.result()
+            adaptive.record(result.bytes_in, result.elapsed)
+            yield result
+
+
+def plan_job(job: BatchJob, passwords: PasswordMap | None = None) -> dict:
+    """Relatório de planejamento (--dry-run) de um trabalho, pronto para JSON."""
+    started = time.perf_counter()
+    report: dict = {"input": job.input_pdf, "output": job.output_pdf}
+    try:
+        job = _with_password(job, passwords)
+        plan = plan_stamp(job.input_pdf, job.cidade, job.d, job.options)
+        report.update(asdict(plan))
+    except Exception as e:
+        report.update(status="error", problems=[_failure_reason(e)], error=f"{type(e).__name__}: {e}")
+    report["elapsed"] = time.perf_counter() - started
+    return report
+
+
+def run_plan(jobs: Iterable[BatchJob], max_workers: int | None = None, passwords: PasswordMap | None = None) -> Iterator[dict]:
+    """Planeja os trabalhos em paralelo, na ordem de entrada, sem gravar PDFs."""
+    jobs = list(jobs)
+    if not jobs:
+        return
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(jobs)))
+    if max_workers == 1:
+        yield from (plan_job(job, passwords) for job in jobs)
+        return
+    # Trabalhos leves: lotes grandes por processo reduzem o custo de comunicação
+    chunksize = max(1, min(256, len(jobs) // (max_workers * 4)))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        yield from pool.map(partial(plan_job, passwords=passwords), jobs, chunksize=chunksize)
+
+
+def summarize(results: list[JobResult]) -> dict:
+    """Totais do lote: contagem por status, MB processados e custo médio por MB."""
+    counts: dict[str, int] = {}
+    for r in results:
+        counts[r.status] = counts.get(r.status, 0) + 1
+    ok = [r for r in results if r.status != "failed"]
+    mb_in = sum(r.bytes_in for r in ok) / (1024 * 1024)
+    cpu_seconds = sum(r.elapsed for r in ok)
+    return {
+        "counts": counts,
+        "mb_in": mb_in,
+        "mb_out": sum(r.bytes_out for r in ok) / (1024 * 1024),
+        "seconds": cpu_seconds,
+        "ms_per_mb": (cpu_seconds * 1000.0 / mb_in) if mb_in > 0 else 0.0,
+    }
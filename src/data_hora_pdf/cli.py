@@ -1,10 +1,24 @@
+from __future__ import annotations
+
+import time
+
+# Início da importação: referência para o tempo até o primeiro quadro da GUI
+_IMPORT_STARTED = time.perf_counter()
+
 import argparse
+import base64
+import hashlib
 import os
 import json
 import sys
 from datetime import date, datetime
+from functools import partial
 from pathlib import Path
-from .stamper import StampOptions, stamp_pdf
+from typing import TYPE_CHECKING
+# Lote, fila e métricas são importados só nos modos que os usam (abertura da GUI mais rápida)
+from .ingest import is_image_input, pdf_output_path
+from .preview import PreviewRenderer
+from .stamper import EncryptedInputError, ProtectionError, StampOptions, compute_layout, detect_stamp, protect_pdf, stamp_pdf
 import tkinter as tk
 from tkinter import filedialog, messagebox
 try:
@@ -16,19 +30,67 @@ try:
 except Exception:
     ttk = None
 
-# Tentar importar tkcalendar para o widget de calendário
-try:
-    from tkcalendar import DateEntry  # type: ignore
-    HAS_CALENDAR = True
-except ImportError:
-    HAS_CALENDAR = False
+if TYPE_CHECKING:
+    from .batch import BatchJob
+    from .credentials import PasswordMap
+    from .profiling import ProfileSettings
+    from .metrics import BatchMetrics
+
+_DATE_ENTRY_CLASS: type | None = None
+_DATE_ENTRY_LOADED = False
+
+
+def _date_entry_class() -> type | None:
+    """DateEntry do tkcalendar, importado apenas quando o calendário é usado."""
+    global _DATE_ENTRY_CLASS, _DATE_ENTRY_LOADED
+    if not _DATE_ENTRY_LOADED:
+        _DATE_ENTRY_LOADED = True
+        try:
+            from tkcalendar import DateEntry  # type: ignore
+
+            _DATE_ENTRY_CLASS = DateEntry
+        except ImportError:
+            _DATE_ENTRY_CLASS = None
+    return _DATE_ENTRY_CLASS
+
+
+def _font_dirs() -> list[Path]:
+    if sys.platform == "win32":
+        return [
+            Path(os.environ.get("WINDIR", r"C:\Windows")) / "Fonts",
+            Path(os.environ.get("LOCALAPPDATA", str(Path.home()))) / "Microsoft" / "Windows" / "Fonts",
+        ]
+    if sys.platform == "darwin":
+        return [Path("/System/Library/Fonts"), Path("/Library/Fonts"), Path.home() / "Library" / "Fonts"]
+    return [
+        Path("/usr/share/fonts"),
+        Path("/usr/local/share/fonts"),
+        Path.home() / ".fonts",
+        Path.home() / ".local" / "share" / "fonts",
+    ]
+
+
+def _font_dirs_fingerprint() -> str:
+    """Impressão digital das pastas de fontes, subpastas incluídas.
+
+    O mtime de uma pasta muda ao instalar/remover fontes nela; as fontes
+    costumam ficar em subpastas (ex.: /usr/share/fonts/truetype/dejavu),
+    então todas entram, sem precisar consultar cada arquivo.
+    """
+    parts = []
+    for folder in _font_dirs():
+        for current, dirs, _files in os.walk(folder):
+            dirs.sort()
+            try:
+                parts.append(f"{current}:{os.stat(current).st_mtime_ns}")
+            except OSError:
+                continue
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
 
 
 def _get_config_file() -> Path:
-    """Retorna o caminho do arquivo de configuração."""
-    config_dir = Path.home() / ".data_hora_pdf"
-    config_dir.mkdir(exist_ok=True)
-    return config_dir / "config.json"
+    """Retorna o caminho do arquivo de configuração (a pasta é criada só ao salvar)."""
+    return Path.home() / ".data_hora_pdf" / "config.json"
 
 
 def _load_config() -> dict:
@@ -47,12 +109,29 @@ def _save_config(config: dict) -> None:
     """Salva as configurações."""
     config_file = _get_config_file()
     try:
+        config_file.parent.mkdir(exist_ok=True)
         with open(config_file, 'w', encoding='utf-8') as f:
             json.dump(config, f, indent=2, ensure_ascii=False)
     except Exception:
         pass
 
 
+def _append_startup_log(line: str, keep: int = 100) -> None:
+    """Acrescenta uma linha ao startup.log, ao lado da configuração (só as últimas keep).
+
+    O executável da GUI roda sem console (pythonw / console=False): o que
+    vai só para o print se perde.
+    """
+    log_file = _get_config_file().with_name("startup.log")
+    try:
+        log_file.parent.mkdir(exist_ok=True)
+        lines = log_file.read_text(encoding="utf-8").splitlines() if log_file.exists() else []
+        lines.append(f"{datetime.now():%Y-%m-%d %H:%M:%S} {line}")
+        log_file.write_text("\n".join(lines[-keep:]) + "\n", encoding="utf-8")
+    except Exception:
+        pass
+
+
 def _hide_console() -> None:
     """Oculta o console do Windows se estiver rodando em Windows."""
     if sys.platform != "win32":
@@ -88,6 +167,18 @@ def _center_window(root: tk.Tk) -> None:
     root.geometry(f"{window_width}x{window_height}+{x}+{y}")
 
 
+def _jobs_arg(raw: str) -> int | str:
+    if raw == "auto":
+        return raw
+    try:
+        value = int(raw)
+    except ValueError:
+        raise argparse.ArgumentTypeError("use um número inteiro ou 'auto'")
+    if value < 1:
+        raise argparse.ArgumentTypeError("o número de processos deve ser pelo menos 1")
+    return value
+
+
 def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(
         prog="data-hora-pdf",
@@ -102,25 +193,71 @@ def build_parser() -> argparse.ArgumentParser:
     p.add_argument("--y", type=float, help="Posição Y em pontos (72pt = 1 polegada)")
     p.add_argument("--font-size", type=float, default=12.0, help="Tamanho da fonte em pt")
     p.add_argument("--font", default=None, help="Família/nome da fonte (helv|times|cour ou nome base do MuPDF)")
+    p.add_argument("--font-file", help="Arquivo de fonte TrueType/OpenType (.ttf/.otf); apenas os glifos usados são embutidos")
     p.add_argument("--color", default="#000000", help="Cor do texto em HEX, ex: #000000")
     p.add_argument("--bold", action="store_true", help="Usar fonte em negrito")
     p.add_argument("--italic", action="store_true", help="Usar fonte em itálico")
     p.add_argument("--gui", action="store_true", help="Abrir seletor de arquivo e salvar automaticamente")
     p.add_argument("--in-place", action="store_true", help="Sobrescrever o arquivo de entrada")
     # Logo
-    p.add_argument("--logo-path", help="Caminho do arquivo de logo (jpg/png). Padrão: Logo.jpg ao lado do PDF.")
+    p.add_argument("--logo-path", help="Caminho do arquivo de logo (jpg/png, ou pdf/svg vetorial). Padrão: Logo.jpg ao lado do PDF.")
     p.add_argument("--logo-width-cm", type=float, default=None, help="Largura do logo em centímetros (se omitido, usa o padrão do código)")
     p.add_argument("--logo-margin-cm", type=float, default=None, help="Margem do logo em cm a partir da borda (se omitido, usa o padrão do código)")
+    p.add_argument("--logo-dpi", type=float, default=None, help="Resolução do logo no tamanho impresso; imagens maiores são reduzidas (padrão 300; 0 = manter original)")
     # Proteção
     p.add_argument("--protection-password", help="Senha para proteção de edição do documento")
     p.add_argument("--restrict-editing", action="store_true", help="Restringir edição do documento")
+    p.add_argument("--open-password", help="Senha para abrir o documento protegido (padrão: a da entrada encriptada, se houver; \"\" remove)")
     p.add_argument("--no-copy", action="store_true", help="Desativar cópia de texto e imagens")
     p.add_argument("--encrypt-content", action="store_true", help="Criptografar todo o conteúdo do documento")
+    p.add_argument("--strict-protection", action="store_true", help="Falhar se a proteção não puder ser aplicada (em vez de salvar sem proteção)")
+    p.add_argument("--protect-only", action="store_true", help="Apenas aplicar/alterar a proteção, sem carimbar (falha se não conseguir proteger)")
+    p.add_argument("--input-password", help="Senha para abrir PDFs de entrada encriptados (a encriptação original é mantida na saída)")
+    p.add_argument("--password-map", help="Arquivo JSON Lines com senhas de entrada por padrão de caminho (pattern) ou impressão digital (sha256)")
     # Data personalizada
     p.add_argument("--date", help="Data personalizada no formato DD/MM/AAAA (não pode ser futura)")
     # Controle de carimbo
     p.add_argument("--no-city", action="store_true", help="Não carimbar a linha da cidade")
     p.add_argument("--no-date", action="store_true", help="Não carimbar a linha da data")
+    # Carimbo anterior
+    p.add_argument(
+        "--if-stamped",
+        choices=("stamp", "skip", "replace"),
+        default="stamp",
+        help="Se a página já estiver carimbada: carimbar de novo (padrão), ignorar ou substituir",
+    )
+    p.add_argument("--compact", action="store_true", help="Gravar o carimbo em um só fluxo de conteúdo, reaproveitando fontes e imagens iguais já presentes na página")
+    p.add_argument("--consolidate-stamps", action="store_true", help="Com --compact, juntar no novo fluxo os carimbos compactos anteriores da página")
+    # Lote
+    p.add_argument("--manifest", help="Manifesto JSON Lines com um trabalho por linha (input, output, cidade, date, ...)")
+    p.add_argument("--input-dir", help="Processar todos os PDFs do diretório (recursivo)")
+    p.add_argument("--output-dir", help="Diretório de saída para --input-dir (mantém a estrutura de pastas)")
+    p.add_argument("--jobs", type=_jobs_arg, default=None, help="Número de processos em paralelo no modo em lote (padrão: nº de CPUs) ou 'auto' para ajustar durante o lote")
+    p.add_argument("--jobs-min", type=int, default=1, help="Mínimo de trabalhos simultâneos com --jobs auto (padrão: 1)")
+    p.add_argument("--jobs-max", type=int, default=None, help="Máximo de trabalhos simultâneos com --jobs auto (padrão: 2x nº de CPUs)")
+    p.add_argument("--dry-run", action="store_true", help="Apenas planejar: valida cada trabalho e calcula o layout final, sem gravar PDFs")
+    p.add_argument("--report", help="Arquivo JSON Lines do relatório de --dry-run (padrão: saída padrão)")
+    p.add_argument("--pipeline", action="store_true", help="Lote em três estágios: leitura antecipada, carimbo em memória e gravação em segundo plano (para arquivos em rede)")
+    p.add_argument("--read-workers", type=int, default=4, help="Leituras simultâneas com --pipeline (padrão: 4)")
+    p.add_argument("--write-workers", type=int, default=4, help="Gravações simultâneas com --pipeline (padrão: 4)")
+    p.add_argument("--prefetch-mb", type=float, default=256.0, help="Limite de MB em memória entre leitura e gravação com --pipeline (padrão: 256)")
+    p.add_argument("--qa-dir", help="Gerar miniaturas da região do carimbo durante o lote e montá-las em folhas de contato nesta pasta")
+    p.add_argument("--qa-per-sheet", type=int, default=100, help="Miniaturas por folha de contato (padrão: 100)")
+    p.add_argument("--qa-thumb-px", type=int, default=160, help="Lado maior de cada miniatura em pixels (padrão: 160)")
+    p.add_argument("--profile-latency", type=float, metavar="SEGUNDOS", help="Capturar perfil (cProfile) dos trabalhos que levarem mais que SEGUNDOS")
+    p.add_argument("--profile-memory", type=float, metavar="MB", help="Capturar perfil de memória (tracemalloc) dos trabalhos que aumentarem o pico de memória em mais que MB")
+    p.add_argument("--profile-sample", type=int, default=0, metavar="N", help="Perfilar 1 de cada N trabalhos como referência (0 = desligado)")
+    p.add_argument("--profile-dir", help="Pasta dos artefatos de perfil (padrão: ao lado de cada saída)")
+    p.add_argument("--metrics-file", help="Exportar métricas do lote no formato texto do Prometheus neste arquivo")
+    p.add_argument("--metrics-port", type=int, help="Expor métricas do lote em http://127.0.0.1:PORTA/metrics")
+    # Fila distribuída (diretório compartilhado)
+    p.add_argument("--enqueue", metavar="FILA", help="Publicar os trabalhos de --manifest/--input-dir na fila compartilhada")
+    p.add_argument("--work", metavar="FILA", help="Atuar como nó: processar trabalhos da fila compartilhada")
+    p.add_argument("--queue-status", metavar="FILA", help="Mostrar a contagem de trabalhos da fila compartilhada")
+    p.add_argument("--node-id", help="Identificador deste nó (padrão: host-pid)")
+    p.add_argument("--lease-ttl", type=float, default=60.0, help="Segundos sem heartbeat até um lease ser retomado por outro nó")
+    p.add_argument("--keep-running", action="store_true", help="Com --work, continuar aguardando novos trabalhos quando a fila esvaziar")
+    p.add_argument("--check-stamped", action="store_true", help="Apenas verificar se a página já foi carimbada (sem salvar)")
     return p
 
 
@@ -131,16 +268,12 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
     # Ocultar console do Windows
     _hide_console()
 
+    gui_started = time.perf_counter()
     root = tk.Tk()
     root.title("Carimbar PDF - Formulário")
 
-    # Mapear famílias de fonte com apoio do tkfont
-    available_families: set[str] = set()
-    if tkfont is not None:
-        try:
-            available_families = {name for name in tkfont.families(root)}
-        except Exception:
-            available_families = set()
+    # Carregar configurações salvas
+    saved_config = _load_config()
 
     font_candidates: list[tuple[str, str, tuple[str, ...]]] = [
         ("helv", "Sans Serif (Helvetica / Arial)", ("Helvetica", "Arial", "Liberation Sans", "DejaVu Sans")),
@@ -176,12 +309,30 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
         normalized = raw.lower().replace(" ", "")
         return aliases.get(normalized, "helv")
 
+    # Famílias da pré-visualização: tkfont.families() é lento com muitas fontes
+    # instaladas, então o resultado fica na configuração enquanto as pastas de
+    # fontes não mudarem
+    font_fingerprint = _font_dirs_fingerprint()
+    cached_fonts = saved_config.get("preview_fonts") or {}
+    preview_families: dict[str, str] = cached_fonts.get("families") or {}
+    if cached_fonts.get("fingerprint") != font_fingerprint or set(preview_families) != {k for k, _l, _f in font_candidates}:
+        available_families: set[str] = set()
+        if tkfont is not None:
+            try:
+                available_families = {name for name in tkfont.families(root)}
+            except Exception:
+                available_families = set()
+        preview_families = {
+            key: next((fam for fam in family_candidates if fam in available_families), family_candidates[0])
+            for key, _label, family_candidates in font_candidates
+        }
+    preview_fonts_entry = {"fingerprint": font_fingerprint, "families": preview_families}
+
     font_ui_data: dict[str, dict[str, str]] = {}
     font_labels: list[str] = []
     label_to_key: dict[str, str] = {}
-    for key, label, family_candidates in font_candidates:
-        preview_family = next((fam for fam in family_candidates if fam in available_families), family_candidates[0])
-        font_ui_data[key] = {"label": label, "preview_family": preview_family}
+    for key, label, _family_candidates in font_candidates:
+        font_ui_data[key] = {"label": label, "preview_family": preview_families[key]}
         font_labels.append(label)
         label_to_key[label] = key
     
@@ -195,9 +346,6 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
     except Exception:
         pass
 
-    # Carregar configurações salvas
-    saved_config = _load_config()
-
     # Defaults a partir dos args e do dataclass
     defaults = StampOptions()
     cidade_default = args.cidade or os.environ.get("CIDADE_PADRAO") or saved_config.get("cidade", "Lages/SC.")
@@ -229,6 +377,11 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
     v_logo_width = tk.DoubleVar(value=saved_config.get("logo_width_cm", args.logo_width_cm if args.logo_width_cm is not None else defaults.logo_width_cm))
     v_logo_margin = tk.DoubleVar(value=saved_config.get("logo_margin_cm", args.logo_margin_cm if args.logo_margin_cm is not None else defaults.logo_margin_cm))
     v_italic = tk.BooleanVar(value=saved_config.get("italic", bool(getattr(args, "italic", False))))
+    # Posição (pt); vazio = posição padrão
+    x_default = args.x if args.x is not None else saved_config.get("x")
+    y_default = args.y if args.y is not None else saved_config.get("y")
+    v_x = tk.StringVar(value="" if x_default is None else f"{x_default:g}")
+    v_y = tk.StringVar(value="" if y_default is None else f"{y_default:g}")
     # Proteção
     v_protection_password = tk.StringVar(value=saved_config.get("protection_password", getattr(args, "protection_password", "") or ""))
     v_restrict_editing = tk.BooleanVar(value=saved_config.get("restrict_editing", bool(getattr(args, "restrict_editing", False))))
@@ -257,7 +410,10 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
 
     # Helpers
     def browse_input():
-        sel = filedialog.askopenfilename(title="Selecione um PDF", filetypes=[("Arquivos PDF", "*.pdf"), ("Todos", "*.*")])
+        sel = filedialog.askopenfilename(
+            title="Selecione um PDF",
+            filetypes=[("Arquivos PDF", "*.pdf"), ("Imagens digitalizadas", "*.tif;*.tiff;*.jpg;*.jpeg;*.png"), ("Todos", "*.*")],
+        )
         if sel:
             v_input.set(sel)
             if v_inplace.get():
@@ -269,7 +425,7 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
             v_output.set(sel)
 
     def browse_logo():
-        sel = filedialog.askopenfilename(title="Selecione o logo", filetypes=[("Imagens", "*.png;*.jpg;*.jpeg"), ("Todos", "*.*")])
+        sel = filedialog.askopenfilename(title="Selecione o logo", filetypes=[("Imagens", "*.png;*.jpg;*.jpeg"), ("Vetoriais", "*.pdf;*.svg"), ("Todos", "*.*")])
         if sel:
             v_logo_path.set(sel)
 
@@ -303,16 +459,20 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
             "color": v_color.get(),
             "bold": v_bold.get(),
             "italic": v_italic.get(),
+            "x": saved_point(v_x.get()),
+            "y": saved_point(v_y.get()),
             "logo_path": v_logo_path.get(),
             "logo_width_cm": v_logo_width.get(),
             "logo_margin_cm": v_logo_margin.get(),
             "restrict_editing": v_restrict_editing.get(),
             "no_copy": v_no_copy.get(),
             "encrypt_content": v_encrypt_content.get(),
+            "protection_enabled": v_show_protection.get(),
             "save_password": v_save_password.get(),
             "stamp_city": v_stamp_city.get(),
             "stamp_date": v_stamp_date.get(),
             "use_custom_date": v_use_custom_date.get() if v_stamp_date.get() else False,
+            "preview_fonts": preview_fonts_entry,
         }
         
         # Salvar senha apenas se a opção estiver marcada
@@ -322,7 +482,7 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
         # Salvar data personalizada se estiver sendo usada
         if v_stamp_date.get() and v_use_custom_date.get():
             try:
-                if HAS_CALENDAR and hasattr(date_entry, 'get_date'):
+                if hasattr(date_entry, 'get_date'):
                     selected_date = date_entry.get_date()
                     config["custom_date"] = selected_date.strftime("%Y-%m-%d")
                 else:
@@ -334,8 +494,55 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
 
     def on_closing():
         """Chamado quando a janela é fechada."""
-        save_current_config()
-        root.destroy()
+        try:
+            save_current_config()
+        except Exception as e:
+            # Campo numérico inválido (ex.: tamanho da fonte) não pode impedir o fechamento
+            print(f"[data-hora-pdf] Aviso: Não foi possível salvar as configurações: {e}")
+        finally:
+            root.destroy()
+
+    def parse_point(raw: str) -> float | None:
+        raw = raw.strip().replace(",", ".")
+        return float(raw) if raw else None
+
+    def saved_point(raw: str) -> float | None:
+        # Ao salvar (inclusive ao fechar a janela), valor inválido não impede a gravação
+        try:
+            return parse_point(raw)
+        except ValueError:
+            return None
+
+    def build_options() -> StampOptions:
+        """Opções de carimbo a partir dos campos do formulário."""
+        opts = StampOptions(
+            page=v_page.get(),
+            x=parse_point(v_x.get()),
+            y=parse_point(v_y.get()),
+            font_size=float(v_fontsize.get()),
+            font=v_font.get().strip() or "helv",
+            color=v_color.get(),
+            bold=bool(v_bold.get()),
+            italic=bool(v_italic.get()),
+            logo_path=v_logo_path.get() or None,
+            stamp_city=bool(v_stamp_city.get()),
+            stamp_date=bool(v_stamp_date.get()),
+        )
+        # Proteção: só com o painel "PROTEÇÃO DO DOCUMENTO" marcado (os campos
+        # continuam preenchidos quando ele é desmarcado, mas não valem)
+        if v_show_protection.get():
+            opts.protection_password = v_protection_password.get().strip() or None
+            opts.restrict_editing = bool(v_restrict_editing.get())
+            opts.allow_copy = not bool(v_no_copy.get())  # Invertido: no_copy -> allow_copy
+            opts.encrypt_content = bool(v_encrypt_content.get())
+        # aplicar parâmetros de logo se informados
+        lw = float(v_logo_width.get())
+        lm = float(v_logo_margin.get())
+        if lw > 0:
+            opts.logo_width_cm = lw
+        if lm >= 0:
+            opts.logo_margin_cm = lm
+        return opts
 
     def do_stamp():
         inp = v_input.get().strip()
@@ -347,42 +554,20 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
             messagebox.showerror("Erro", f"Arquivo não encontrado:\n{inp}", parent=root)
             return
         if v_inplace.get():
-            outp = inp
+            # Imagem digitalizada: "mesmo arquivo" é o .pdf de mesmo nome
+            outp = pdf_output_path(inp) if is_image_input(inp) else inp
         elif not outp:
             messagebox.showerror("Erro", "Informe o caminho de saída ou marque 'Salvar no mesmo arquivo'.", parent=root)
             return
 
         try:
-            opts = StampOptions(
-                page=v_page.get(),
-                font_size=float(v_fontsize.get()),
-                font=v_font.get().strip() or "helv",
-                color=v_color.get(),
-                bold=bool(v_bold.get()),
-                italic=bool(v_italic.get()),
-                logo_path=v_logo_path.get() or None,
-                # Proteção
-                protection_password=v_protection_password.get().strip() or None,
-                restrict_editing=bool(v_restrict_editing.get()),
-                allow_copy=not bool(v_no_copy.get()),  # Invertido: no_copy -> allow_copy
-                encrypt_content=bool(v_encrypt_content.get()),
-                stamp_city=bool(v_stamp_city.get()),
-                stamp_date=bool(v_stamp_date.get()),
-            )
-            # aplicar parâmetros de logo se informados
-            lw = float(v_logo_width.get())
-            lm = float(v_logo_margin.get())
-            if lw > 0:
-                opts.logo_width_cm = lw
-            if lm >= 0:
-                opts.logo_margin_cm = lm
-
+            opts = build_options()
             cidade_val = v_cidade.get().strip() or cidade_default
             
             # Determinar qual data usar
             if v_use_custom_date.get():
                 try:
-                    if HAS_CALENDAR and hasattr(date_entry, 'get_date'):
+                    if hasattr(date_entry, 'get_date'):
                         selected_date = date_entry.get_date()
                     else:
                         # Fallback para campo de texto
@@ -412,6 +597,7 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
         lbl = (ttk.Label(container, text=label_text) if ttk else tk.Label(container, text=label_text))
         lbl.grid(row=row, column=0, sticky="w", pady=4)
         widget.grid(row=row, column=1, sticky="we", pady=4)
+        return lbl
 
     # Input/output
     in_row = (ttk.Frame(container) if ttk else tk.Frame(container))
@@ -454,25 +640,39 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
     # Variável para data no formato string (para fallback)
     v_date_string = tk.StringVar(value=default_date.strftime("%d/%m/%Y"))
     
-    # Criar widget de data baseado na disponibilidade do tkcalendar
-    if HAS_CALENDAR:
-        date_entry = DateEntry(date_row, 
-                             width=12, 
-                             background='darkblue',
-                             foreground='white', 
-                             borderwidth=2,
-                             date_pattern='dd/mm/yyyy',
-                             maxdate=date.today(),  # Não permite datas futuras
-                             state="disabled")
-        date_entry.set_date(default_date)
-    else:
-        # Fallback para Entry simples se tkcalendar não estiver disponível
-        date_entry = (ttk.Entry(date_row, textvariable=v_date_string, width=12, state="disabled") if ttk else tk.Entry(date_row, textvariable=v_date_string, width=12, state="disabled"))
-    
+    # Campo simples até a data personalizada ser usada; o calendário (tkcalendar)
+    # é importado e criado só na primeira vez (fallback: o próprio campo de texto)
+    date_entry = (ttk.Entry(date_row, textvariable=v_date_string, width=12, state="disabled") if ttk else tk.Entry(date_row, textvariable=v_date_string, width=12, state="disabled"))
+
     use_custom_chk.pack(side=tk.LEFT, padx=(0, 5))
     date_entry.pack(side=tk.LEFT)
     add_row(6, "", date_row)
-    
+
+    def ensure_calendar() -> None:
+        nonlocal date_entry
+        if hasattr(date_entry, 'get_date'):
+            return
+        date_entry_class = _date_entry_class()
+        if date_entry_class is None:
+            return
+        try:
+            current = min(datetime.strptime(v_date_string.get(), "%d/%m/%Y").date(), date.today())
+        except ValueError:
+            current = default_date
+        calendar = date_entry_class(date_row,
+                                    width=12,
+                                    background='darkblue',
+                                    foreground='white',
+                                    borderwidth=2,
+                                    date_pattern='dd/mm/yyyy',
+                                    maxdate=date.today(),  # Não permite datas futuras
+                                    state="disabled")
+        calendar.set_date(current)
+        calendar.bind("<<DateEntrySelected>>", schedule_preview)
+        date_entry.destroy()
+        date_entry = calendar
+        date_entry.pack(side=tk.LEFT)
+
     # Redefinir a função toggle_custom_date agora que os widgets foram criados
     def toggle_custom_date():
         """Habilita/desabilita o seletor de data."""
@@ -484,6 +684,7 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
 
         use_custom_chk.configure(state="normal")
         if v_use_custom_date.get():
+            ensure_calendar()
             date_entry.configure(state="normal")
         else:
             date_entry.configure(state="disabled")
@@ -547,6 +748,18 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
     italic_chk.pack(side=tk.LEFT, padx=6)
     add_row(10, "Estilo:", style_row)
 
+    # Posição do carimbo (também definida clicando na pré-visualização)
+    pos_row = (ttk.Frame(container) if ttk else tk.Frame(container))
+    x_entry = (ttk.Entry(pos_row, textvariable=v_x, width=8) if ttk else tk.Entry(pos_row, textvariable=v_x, width=8))
+    y_entry = (ttk.Entry(pos_row, textvariable=v_y, width=8) if ttk else tk.Entry(pos_row, textvariable=v_y, width=8))
+    pos_reset_btn = (ttk.Button(pos_row, text="Padrão", command=lambda: (v_x.set(""), v_y.set(""))) if ttk else tk.Button(pos_row, text="Padrão", command=lambda: (v_x.set(""), v_y.set(""))))
+    (ttk.Label(pos_row, text="X:") if ttk else tk.Label(pos_row, text="X:")).pack(side=tk.LEFT)
+    x_entry.pack(side=tk.LEFT, padx=(2, 8))
+    (ttk.Label(pos_row, text="Y:") if ttk else tk.Label(pos_row, text="Y:")).pack(side=tk.LEFT)
+    y_entry.pack(side=tk.LEFT, padx=(2, 8))
+    pos_reset_btn.pack(side=tk.LEFT)
+    add_row(11, "Posição (pt):", pos_row)
+
     if preview_font_obj is not None:
         v_bold.trace_add("write", lambda *_args: update_font_preview())
         v_italic.trace_add("write", lambda *_args: update_font_preview())
@@ -557,40 +770,60 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
     logo_btn = (ttk.Button(logo_row, text="Selecionar...", command=browse_logo) if ttk else tk.Button(logo_row, text="Selecionar...", command=browse_logo))
     logo_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
     logo_btn.pack(side=tk.LEFT, padx=6)
-    add_row(11, "Logo (opcional):", logo_row)
+    add_row(12, "Logo (opcional):", logo_row)
 
     logo_w_spin = (ttk.Spinbox(container, from_=0.5, to=20, increment=0.5, textvariable=v_logo_width, width=6) if ttk else tk.Spinbox(container, from_=0.5, to=20, increment=0.5, textvariable=v_logo_width, width=6))
-    add_row(12, "Logo largura (cm):", logo_w_spin)
+    add_row(13, "Logo largura (cm):", logo_w_spin)
 
     logo_m_spin = (ttk.Spinbox(container, from_=0.0, to=20, increment=0.5, textvariable=v_logo_margin, width=6) if ttk else tk.Spinbox(container, from_=0.0, to=20, increment=0.5, textvariable=v_logo_margin, width=6))
-    add_row(13, "Logo margem (cm):", logo_m_spin)
-
-    # Separador para proteção
-    sep_label = (ttk.Label(container, text="PROTEÇÃO DO DOCUMENTO", font=("TkDefaultFont", 9, "bold")) if ttk else tk.Label(container, text="PROTEÇÃO DO DOCUMENTO", font=("TkDefaultFont", 9, "bold")))
-    add_row(14, "", sep_label)
+    add_row(14, "Logo margem (cm):", logo_m_spin)
+
+    # Painel de proteção: criado só quando aberto pela primeira vez. Marcado =
+    # proteção aplicada; o estado é salvo, e proteção pedida na linha de comando o marca
+    cli_protection = any(getattr(args, name, None) for name in ("protection_password", "restrict_editing", "no_copy", "encrypt_content"))
+    v_show_protection = tk.BooleanVar(value=cli_protection or saved_config.get("protection_enabled", bool(
+        v_protection_password.get() or v_restrict_editing.get() or v_no_copy.get() or v_encrypt_content.get()
+    )))
+    protection_widgets: list = []
+    password_entry = None
+
+    def build_protection_panel() -> None:
+        nonlocal password_entry
+        # Campos de proteção
+        password_row = (ttk.Frame(container) if ttk else tk.Frame(container))
+        password_entry = (ttk.Entry(password_row, textvariable=v_protection_password, show="*", width=30) if ttk else tk.Entry(password_row, textvariable=v_protection_password, show="*", width=30))
+        show_password_chk = (ttk.Checkbutton(password_row, text="Mostrar", variable=v_show_password, command=toggle_password_visibility) if ttk else tk.Checkbutton(password_row, text="Mostrar", variable=v_show_password, command=toggle_password_visibility))
+        save_password_chk = (ttk.Checkbutton(password_row, text="Salvar como padrão", variable=v_save_password) if ttk else tk.Checkbutton(password_row, text="Salvar como padrão", variable=v_save_password))
+
+        password_entry.pack(side=tk.LEFT, padx=(0, 5))
+        show_password_chk.pack(side=tk.LEFT, padx=(0, 5))
+        save_password_chk.pack(side=tk.LEFT)
+        protection_widgets.extend((password_row, add_row(16, "Senha para edição:", password_row)))
+
+        protect_row = (ttk.Frame(container) if ttk else tk.Frame(container))
+        restrict_chk = (ttk.Checkbutton(protect_row, text="Restringir edição", variable=v_restrict_editing) if ttk else tk.Checkbutton(protect_row, text="Restringir edição", variable=v_restrict_editing))
+        no_copy_chk = (ttk.Checkbutton(protect_row, text="Desativar cópia", variable=v_no_copy) if ttk else tk.Checkbutton(protect_row, text="Desativar cópia", variable=v_no_copy))
+        restrict_chk.pack(side=tk.LEFT, padx=6)
+        no_copy_chk.pack(side=tk.LEFT, padx=6)
+        protection_widgets.extend((protect_row, add_row(17, "Restrições:", protect_row)))
+
+        encrypt_row = (ttk.Frame(container) if ttk else tk.Frame(container))
+        encrypt_chk = (ttk.Checkbutton(encrypt_row, text="Criptografar todo o conteúdo", variable=v_encrypt_content) if ttk else tk.Checkbutton(encrypt_row, text="Criptografar todo o conteúdo", variable=v_encrypt_content))
+        encrypt_chk.pack(side=tk.LEFT, padx=6)
+        protection_widgets.extend((encrypt_row, add_row(18, "Criptografia:", encrypt_row)))
+
+    def toggle_protection_panel() -> None:
+        if not v_show_protection.get():
+            for widget in protection_widgets:
+                widget.grid_remove()
+        elif not protection_widgets:
+            build_protection_panel()
+        else:
+            for widget in protection_widgets:
+                widget.grid()
 
-    # Campos de proteção
-    password_row = (ttk.Frame(container) if ttk else tk.Frame(container))
-    password_entry = (ttk.Entry(password_row, textvariable=v_protection_password, show="*", width=30) if ttk else tk.Entry(password_row, textvariable=v_protection_password, show="*", width=30))
-    show_password_chk = (ttk.Checkbutton(password_row, text="Mostrar", variable=v_show_password, command=toggle_password_visibility) if ttk else tk.Checkbutton(password_row, text="Mostrar", variable=v_show_password, command=toggle_password_visibility))
-    save_password_chk = (ttk.Checkbutton(password_row, text="Salvar como padrão", variable=v_save_password) if ttk else tk.Checkbutton(password_row, text="Salvar como padrão", variable=v_save_password))
-    
-    password_entry.pack(side=tk.LEFT, padx=(0, 5))
-    show_password_chk.pack(side=tk.LEFT, padx=(0, 5))
-    save_password_chk.pack(side=tk.LEFT)
-    add_row(15, "Senha para edição:", password_row)
-
-    protect_row = (ttk.Frame(container) if ttk else tk.Frame(container))
-    restrict_chk = (ttk.Checkbutton(protect_row, text="Restringir edição", variable=v_restrict_editing) if ttk else tk.Checkbutton(protect_row, text="Restringir edição", variable=v_restrict_editing))
-    no_copy_chk = (ttk.Checkbutton(protect_row, text="Desativar cópia", variable=v_no_copy) if ttk else tk.Checkbutton(protect_row, text="Desativar cópia", variable=v_no_copy))
-    restrict_chk.pack(side=tk.LEFT, padx=6)
-    no_copy_chk.pack(side=tk.LEFT, padx=6)
-    add_row(16, "Restrições:", protect_row)
-
-    encrypt_row = (ttk.Frame(container) if ttk else tk.Frame(container))
-    encrypt_chk = (ttk.Checkbutton(encrypt_row, text="Criptografar todo o conteúdo", variable=v_encrypt_content) if ttk else tk.Checkbutton(encrypt_row, text="Criptografar todo o conteúdo", variable=v_encrypt_content))
-    encrypt_chk.pack(side=tk.LEFT, padx=6)
-    add_row(17, "Criptografia:", encrypt_row)
+    sep_chk = (ttk.Checkbutton(container, text="PROTEÇÃO DO DOCUMENTO", variable=v_show_protection, command=toggle_protection_panel) if ttk else tk.Checkbutton(container, text="PROTEÇÃO DO DOCUMENTO", variable=v_show_protection, command=toggle_protection_panel, font=("TkDefaultFont", 9, "bold")))
+    add_row(15, "", sep_chk)
 
     # Botões
     btn_row = (ttk.Frame(container) if ttk else tk.Frame(container))
@@ -598,7 +831,122 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
     quit_btn = (ttk.Button(btn_row, text="Sair", command=on_closing) if ttk else tk.Button(btn_row, text="Sair", command=on_closing))
     run_btn.pack(side=tk.LEFT)
     quit_btn.pack(side=tk.LEFT, padx=8)
-    add_row(18, "", btn_row)
+    add_row(19, "", btn_row)
+
+    # Pré-visualização da página com o carimbo e o logo projetados
+    preview_box = (300, 420)
+    preview_frame = (ttk.Frame(container) if ttk else tk.Frame(container))
+    preview_canvas = tk.Canvas(preview_frame, width=preview_box[0], height=preview_box[1], background="#808080", highlightthickness=0, cursor="crosshair")
+    preview_canvas.pack()
+    preview_status = (ttk.Label(preview_frame, text="Clique na página para posicionar o carimbo") if ttk else tk.Label(preview_frame, text="Clique na página para posicionar o carimbo"))
+    preview_status.pack(pady=(4, 0))
+    preview_frame.grid(row=0, column=2, rowspan=20, sticky="n", padx=(12, 0))
+
+    preview_renderer = PreviewRenderer()
+    preview_state: dict = {"page": None, "image": None, "after": None, "polling": False}
+
+    def preview_date() -> date:
+        if v_use_custom_date.get():
+            try:
+                if hasattr(date_entry, 'get_date'):
+                    return date_entry.get_date()
+                return datetime.strptime(v_date_string.get(), "%d/%m/%Y").date()
+            except Exception:
+                pass
+        return date.today()
+
+    def draw_overlay() -> None:
+        preview_canvas.delete("overlay")
+        rendered = preview_state["page"]
+        if rendered is None:
+            return
+        try:
+            layout = compute_layout(
+                rendered.page_width,
+                rendered.page_height,
+                v_cidade.get().strip() or cidade_default,
+                preview_date(),
+                build_options(),
+                v_input.get().strip() or None,
+            )
+        except Exception:
+            return
+        z = rendered.zoom
+        if layout.text_rect:
+            x0, y0, x1, y1 = layout.text_rect
+            preview_canvas.create_rectangle(x0 * z, y0 * z, x1 * z, y1 * z, outline="#d00000", width=2, tags="overlay")
+        if layout.logo_rect:
+            x0, y0, x1, y1 = layout.logo_rect
+            preview_canvas.create_rectangle(x0 * z, y0 * z, x1 * z, y1 * z, outline="#0050d0", dash=(4, 2), width=2, tags="overlay")
+
+    def show_rendered(rendered) -> None:
+        preview_state["page"] = rendered
+        preview_state["image"] = tk.PhotoImage(data=base64.b64encode(rendered.png))
+        preview_canvas.delete("page")
+        preview_canvas.create_image(0, 0, anchor="nw", image=preview_state["image"], tags="page")
+        preview_canvas.tag_lower("page")
+        preview_status.configure(text=f"Página {rendered.page + 1} de {rendered.page_count} | clique para posicionar")
+        draw_overlay()
+
+    def poll_preview() -> None:
+        item = preview_renderer.poll()
+        if item is None:
+            # Sem resultado do pedido mais recente (os de pedidos superados são descartados)
+            if preview_renderer.pending:
+                root.after(50, poll_preview)
+            else:
+                preview_state["polling"] = False
+            return
+        preview_state["polling"] = False
+        if isinstance(item, Exception):
+            preview_state["page"] = None
+            preview_canvas.delete("all")
+            preview_status.configure(text=f"Sem pré-visualização: {item}")
+        else:
+            show_rendered(item)
+
+    def refresh_preview() -> None:
+        preview_state["after"] = None
+        inp = v_input.get().strip()
+        try:
+            page_index = int(v_page.get())
+        except Exception:
+            return
+        if not inp or not os.path.exists(inp):
+            preview_state["page"] = None
+            preview_canvas.delete("all")
+            preview_status.configure(text="Selecione um PDF para pré-visualizar")
+            return
+        current = preview_state["page"]
+        if current is not None and current.path == inp and current.page == page_index:
+            # Mesma página: só o carimbo projetado muda
+            draw_overlay()
+            return
+        cached = preview_renderer.request(inp, page_index, preview_box)
+        if cached is not None:
+            show_rendered(cached)
+        elif not preview_state["polling"]:
+            preview_state["polling"] = True
+            preview_status.configure(text="Renderizando...")
+            root.after(50, poll_preview)
+
+    def schedule_preview(*_args) -> None:
+        if preview_state["after"] is not None:
+            root.after_cancel(preview_state["after"])
+        preview_state["after"] = root.after(120, refresh_preview)
+
+    def on_preview_click(event) -> None:
+        rendered = preview_state["page"]
+        if rendered is None:
+            return
+        # O clique define o início (x) e a linha de base da última linha (y)
+        v_x.set(f"{event.x / rendered.zoom:.0f}")
+        v_y.set(f"{event.y / rendered.zoom:.0f}")
+
+    preview_canvas.bind("<Button-1>", on_preview_click)
+    for var in (v_input, v_page, v_cidade, v_stamp_city, v_stamp_date, v_fontsize, v_font, v_bold, v_italic,
+                v_x, v_y, v_logo_path, v_logo_width, v_logo_margin, v_use_custom_date, v_date_string):
+        var.trace_add("write", schedule_preview)
 
     # Ajustes finais
     container.columnconfigure(1, weight=1)
@@ -606,12 +954,32 @@ def _run_gui_with_form(args: argparse.Namespace) -> int:
     on_toggle_inplace()
     on_toggle_stamp_city()
     on_toggle_stamp_date()  # já aciona toggle_custom_date internamente
+    toggle_protection_panel()
+    schedule_preview()
+
+    def report_first_frame(_event=None) -> None:
+        root.unbind("<Map>")
+
+        def log() -> None:
+            now = time.perf_counter()
+            message = (
+                f"Primeiro quadro da GUI: {(now - _IMPORT_STARTED) * 1000:.0f} ms desde a importação "
+                f"({(now - gui_started) * 1000:.0f} ms de montagem da janela)"
+            )
+            _append_startup_log(message)
+            try:
+                print(f"[data-hora-pdf] {message}")
+            except Exception:
+                pass
+        root.after_idle(log)
+
+    root.bind("<Map>", report_first_frame)
     
     # Configurar protocolo de fechamento da janela
     root.protocol("WM_DELETE_WINDOW", on_closing)
     
     # Definir tamanho mínimo e centralizar
-    root.minsize(580, 500)
+    root.minsize(900, 540)
     _center_window(root)
     
     # Focar na janela
@@ -628,10 +996,12 @@ def main(argv: list[str] | None = None) -> int:
 
     # Modo GUI por padrão se nenhum argumento específico for fornecido
     # ou se --gui foi especificado explicitamente
+    # (modos em lote/fila não usam --input)
+    has_batch_source = bool(args.manifest or args.input_dir or args.work or args.queue_status)
     should_use_gui = (
         args.gui or 
-        not args.input or 
-        (not args.input and not args.output and not args.cidade and len([x for x in (argv or []) if not x.startswith('--')]) == 0)
+        (not args.input and not has_batch_source) or 
+        (not args.input and not has_batch_source and not args.output and not args.cidade and len([x for x in (argv or []) if not x.startswith('--')]) == 0)
     )
     
     if should_use_gui:
@@ -641,15 +1011,47 @@ def main(argv: list[str] | None = None) -> int:
     stamp_city = not getattr(args, "no_city", False)
     stamp_date = not getattr(args, "no_date", False)
 
-    if not args.input or (not args.output and not args.in_place):
-        parser.error("Parâmetros obrigatórios ausentes: --input e (--output ou --in-place).")
-    if stamp_city and not args.cidade:
-        parser.error("Informe --cidade ou utilize --no-city para não carimbar a linha da cidade.")
+    if args.queue_status:
+        from .distributed import queue_status
+
+        counts = queue_status(args.queue_status)
+        print(" | ".join(f"{k}={v}" for k, v in counts.items()))
+        return 0
+    if args.jobs == "auto" and (args.work or args.pipeline):
+        parser.error("--jobs auto está disponível apenas no lote local (sem --work/--pipeline).")
+    if args.pipeline and _profile_from_args(args) is not None:
+        parser.error("--profile-* está disponível no lote local e na fila (sem --pipeline).")
+    if args.qa_dir and (args.work or args.enqueue or args.protect_only):
+        parser.error("--qa-dir está disponível apenas no carimbo em lote local (sem --work/--enqueue/--protect-only).")
+    passwords = None
+    if args.password_map:
+        from .credentials import PasswordMap
 
-    input_path = Path(args.input)
-    output_path = Path(args.input) if args.in_place else Path(args.output)
-    if not input_path.exists():
-        parser.error(f"Arquivo de entrada não encontrado: {input_path}")
+        try:
+            passwords = PasswordMap.load(args.password_map)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    if args.work:
+        return _run_node_cli(args, passwords)
+
+    if args.check_stamped:
+        input_path = Path(args.input)
+        if not input_path.exists():
+            parser.error(f"Arquivo de entrada não encontrado: {input_path}")
+        password = args.input_password or (passwords.password_for(str(input_path)) if passwords else None)
+        try:
+            marker = detect_stamp(
+                str(input_path),
+                StampOptions(page=args.page, x=args.x, y=args.y, font_size=args.font_size, input_password=password),
+            )
+        except EncryptedInputError as e:
+            print(f"[data-hora-pdf] Erro: {e}", file=sys.stderr)
+            return 2
+        if marker is None:
+            print(f"Não carimbado: {input_path}")
+            return 1
+        print(f"Já carimbado ({marker.source}): {input_path} | {' / '.join(marker.lines)}")
+        return 0
 
     opts = StampOptions(
         page=args.page,
@@ -657,40 +1059,261 @@ def main(argv: list[str] | None = None) -> int:
         y=args.y,
         font_size=args.font_size,
         font=(args.font or "helv"),
+        font_file=args.font_file,
         color=args.color,
         bold=args.bold,
         italic=args.italic,
         logo_path=args.logo_path,
         # Proteção
         protection_password=getattr(args, "protection_password", None),
+        open_password=getattr(args, "open_password", None),
         restrict_editing=getattr(args, "restrict_editing", False),
         allow_copy=not getattr(args, "no_copy", False),  # Invertido
         encrypt_content=getattr(args, "encrypt_content", False),
+        strict_protection=bool(args.strict_protection or args.protect_only),
+        input_password=args.input_password,
         stamp_city=stamp_city,
         stamp_date=stamp_date,
+        if_stamped=args.if_stamped,
+        compact=bool(args.compact or args.consolidate_stamps),
+        consolidate_stamps=args.consolidate_stamps,
     )
     if args.logo_width_cm is not None:
         opts.logo_width_cm = args.logo_width_cm
     if args.logo_margin_cm is not None:
         opts.logo_margin_cm = args.logo_margin_cm
+    if args.logo_dpi is not None:
+        opts.logo_dpi = args.logo_dpi
+
+    has_protection = opts.protection_password or opts.open_password or opts.restrict_editing or not opts.allow_copy or opts.encrypt_content
+    if args.protect_only and not has_protection:
+        parser.error("--protect-only exige --protection-password, --open-password, --restrict-editing, --no-copy ou --encrypt-content.")
     
     # Determinar a data a ser usada
     if getattr(args, 'date', None):
         try:
             custom_date = datetime.strptime(args.date, "%d/%m/%Y").date()
-            if custom_date > date.today():
+            # No --dry-run a data futura entra no relatório (future_date) em vez de abortar
+            if custom_date > date.today() and not args.dry_run:
                 parser.error("A data não pode ser futura.")
             use_date = custom_date
         except ValueError:
             parser.error("Formato de data inválido. Use DD/MM/AAAA")
     else:
         use_date = date.today()
-    
+
+    if args.manifest or args.input_dir:
+        return _run_batch_cli(parser, args, opts, use_date, passwords)
+
+    if args.dry_run and args.input:
+        from .batch import BatchJob
+
+        output = args.output or (pdf_output_path(args.input) if is_image_input(args.input) else args.input)
+        job = BatchJob(args.input, output, args.cidade or "", use_date, opts)
+        return _run_plan_cli(args, [job], passwords)
+    if not args.input or (not args.output and not args.in_place):
+        parser.error("Parâmetros obrigatórios ausentes: --input e (--output ou --in-place).")
+    if stamp_city and not args.cidade and not args.protect_only:
+        parser.error("Informe --cidade ou utilize --no-city para não carimbar a linha da cidade.")
+
+    input_path = Path(args.input)
+    if args.in_place:
+        # Imagem digitalizada nunca é sobrescrita: gera o .pdf de mesmo nome
+        output_path = Path(pdf_output_path(args.input)) if is_image_input(args.input) else Path(args.input)
+    else:
+        output_path = Path(args.output)
+    if not input_path.exists():
+        parser.error(f"Arquivo de entrada não encontrado: {input_path}")
+    if passwords is not None and not opts.input_password:
+        opts.input_password = passwords.password_for(str(input_path))
+
+    if args.protect_only:
+        try:
+            protect_pdf(str(input_path), str(output_path), opts)
+        except (ProtectionError, EncryptedInputError) as e:
+            print(f"[data-hora-pdf] Erro: {e}", file=sys.stderr)
+            return 1
+        print(f"PDF protegido: {output_path}")
+        return 0
+
     cidade_cli = args.cidade or ""
-    stamp_pdf(str(input_path), str(output_path), cidade_cli, use_date, opts)
+    try:
+        result = stamp_pdf(str(input_path), str(output_path), cidade_cli, use_date, opts)
+    except EncryptedInputError as e:
+        print(f"[data-hora-pdf] Erro: {e}", file=sys.stderr)
+        return 1
+    if result.status == "skipped":
+        print(f"PDF já carimbado, nada gravado: {input_path}")
+        return 0
     print(f"PDF gerado: {output_path}")
     return 0
 
 
+def _metrics_from_args(args: argparse.Namespace) -> BatchMetrics | None:
+    if not (args.metrics_file or args.metrics_port):
+        return None
+    from .metrics import BatchMetrics
+
+    metrics = BatchMetrics(textfile=args.metrics_file)
+    if args.metrics_port:
+        metrics.registry.serve(args.metrics_port)
+    return metrics
+
+
+def _profile_from_args(args: argparse.Namespace) -> ProfileSettings | None:
+    if args.profile_latency is None and args.profile_memory is None and not args.profile_sample:
+        return None
+    from .profiling import ProfileSettings
+
+    return ProfileSettings(
+        latency_seconds=args.profile_latency,
+        memory_mb=args.profile_memory,
+        sample_every=max(0, args.profile_sample),
+        artifact_dir=args.profile_dir,
+    )
+
+
+def _run_node_cli(args: argparse.Namespace, passwords: PasswordMap | None = None) -> int:
+    """Nó da fila distribuída: processa trabalhos até esvaziar a fila (ou continuamente)."""
+    from .distributed import run_node
+
+    results = run_node(
+        args.work,
+        node_id=args.node_id,
+        max_workers=args.jobs,
+        lease_ttl=args.lease_ttl,
+        keep_running=args.keep_running,
+        metrics=_metrics_from_args(args),
+        profile=_profile_from_args(args),
+        passwords=passwords,
+        secrets={
+            name: value
+            for name, value in (
+                ("input_password", args.input_password),
+                ("protection_password", getattr(args, "protection_password", None)),
+                ("open_password", getattr(args, "open_password", None)),
+            )
+            if value
+        },
+    )
+    for r in results:
+        if r.status == "failed":
+            print(f"[data-hora-pdf] Falha: {r.input_pdf}: {r.error}", file=sys.stderr)
+        if r.profile:
+            print(f"[data-hora-pdf] Perfil capturado: {r.input_pdf} -> {r.profile}")
+    failed = sum(1 for r in results if r.status == "failed")
+    print(f"Nó concluído: {len(results)} trabalho(s), {failed} falha(s)")
+    return 1 if failed else 0
+
+
+def _run_plan_cli(args: argparse.Namespace, jobs: list[BatchJob], passwords: PasswordMap | None = None) -> int:
+    """--dry-run: um relatório JSON por trabalho e o resumo por status/problema."""
+    from .batch import run_plan
+
+    jobs_arg = None if args.jobs == "auto" else args.jobs
+    out = open(args.report, "w", encoding="utf-8") if args.report else sys.stdout
+    statuses: dict[str, int] = {}
+    problems: dict[str, int] = {}
+    try:
+        for report in run_plan(jobs, jobs_arg, passwords):
+            out.write(json.dumps(report, ensure_ascii=False) + "\n")
+            statuses[report["status"]] = statuses.get(report["status"], 0) + 1
+            for problem in report["problems"]:
+                problems[problem] = problems.get(problem, 0) + 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    summary = ", ".join(f"{k}={v}" for k, v in sorted(statuses.items()))
+    print(f"Planejamento: {len(jobs)} trabalho(s) | {summary}", file=sys.stderr)
+    for problem, count in sorted(problems.items(), key=lambda item: -item[1]):
+        print(f"  {problem}: {count}", file=sys.stderr)
+    return 1 if statuses.get("error") else 0
+
+
+def _run_batch_cli(
+    parser: argparse.ArgumentParser,
+    args: argparse.Namespace,
+    opts: StampOptions,
+    use_date: date,
+    passwords: PasswordMap | None = None,
+) -> int:
+    """Modo em lote: manifesto JSON Lines ou diretório de PDFs, em paralelo."""
+    from .batch import BatchJob, jobs_from_directory, load_manifest, run_batch, run_protect_job, run_stamp_job, summarize
+    from .concurrency import AdaptiveConcurrency
+    from .contact_sheet import ContactSheetWriter
+    from .distributed import enqueue
+    from .pipeline import run_pipeline
+
+    if args.qa_dir:
+        opts.thumbnail_px = args.qa_thumb_px
+    base = BatchJob(input_pdf="", output_pdf="", cidade=args.cidade or "", d=use_date, options=opts)
+    if args.manifest:
+        try:
+            jobs = load_manifest(args.manifest, base, allow_future=args.dry_run)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    else:
+        if not args.output_dir and not args.in_place:
+            parser.error("Com --input-dir informe --output-dir ou --in-place.")
+        jobs = jobs_from_directory(args.input_dir, args.output_dir, base)
+
+    if args.dry_run:
+        return _run_plan_cli(args, jobs, passwords)
+    if args.enqueue:
+        count = enqueue(args.enqueue, jobs, mode="protect" if args.protect_only else "stamp")
+        print(f"{count} trabalho(s) publicados na fila: {args.enqueue}")
+        if any(job.options.input_password or job.options.protection_password or job.options.open_password for job in jobs):
+            print("[data-hora-pdf] Senhas não são publicadas na fila: informe --password-map/--input-password, --protection-password e --open-password em cada nó (--work).")
+        return 0
+
+    metrics = _metrics_from_args(args)
+    if args.pipeline:
+        stream = run_pipeline(
+            jobs,
+            mode="protect" if args.protect_only else "stamp",
+            read_workers=args.read_workers,
+            stamp_workers=args.jobs,
+            write_workers=args.write_workers,
+            prefetch_bytes=int(args.prefetch_mb * 1024 * 1024),
+            metrics=metrics,
+            passwords=passwords,
+        )
+    else:
+        worker = run_protect_job if args.protect_only else run_stamp_job
+        profile = _profile_from_args(args)
+        if profile is not None or passwords is not None:
+            worker = partial(worker, profile=profile, passwords=passwords)
+        if args.jobs == "auto":
+            adaptive = AdaptiveConcurrency(floor=args.jobs_min, ceiling=args.jobs_max)
+            stream = run_batch(jobs, worker, metrics=metrics, adaptive=adaptive)
+        else:
+            stream = run_batch(jobs, worker, args.jobs, metrics=metrics)
+    sheets = ContactSheetWriter(args.qa_dir, args.qa_per_sheet, args.qa_thumb_px) if args.qa_dir else None
+    results = []
+    for r in stream:
+        # Carimbo fora da página também entra no índice, mesmo sem miniatura
+        note = "fora da página" if {"text_outside_page", "logo_outside_page"} & set(r.events) else None
+        if sheets is not None and (r.thumbnail or note):
+            sheets.add(r.thumbnail, r.input_pdf, r.output_pdf, note)
+        r.thumbnail = None  # já na folha de contato; não manter 40k miniaturas em memória
+        results.append(r)
+        if r.status == "failed":
+            print(f"[data-hora-pdf] Falha: {r.input_pdf}: {r.error}", file=sys.stderr)
+        if r.profile:
+            print(f"[data-hora-pdf] Perfil capturado: {r.input_pdf} -> {r.profile}")
+
+    if sheets is not None:
+        pages = sheets.close()
+        print(f"Conferência: {sheets.count} miniatura(s) em {len(pages)} folha(s) de contato | {Path(args.qa_dir) / 'index.jsonl'}")
+
+    summary = summarize(results)
+    counts = ", ".join(f"{k}={v}" for k, v in sorted(summary["counts"].items()))
+    print(f"Lote concluído: {len(results)} arquivo(s) | {counts} | {summary['mb_in']:.1f} MB")
+    if args.protect_only:
+        method = "AES-256" if opts.encrypt_content else "RC4-128"
+        print(f"Custo da proteção {method}: {summary['ms_per_mb']:.1f} ms/MB")
+    return 1 if summary["counts"].get("failed") else 0
+
+
 if __name__ == "__main__":
     raise SystemExit(main())
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import os
+import statistics
+import time
+
+try:
+    import psutil  # type: ignore
+except ImportError:
+    psutil = None
+
+
+def memory_pressure() -> float:
+    """Fração da memória do host em uso (0.0 a 1.0; 0.0 se indisponível)."""
+    if psutil is not None:
+        try:
+            return float(psutil.virtual_memory().percent) / 100.0
+        except Exception:
+            pass
+    try:
+        info: dict[str, int] = {}
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                info[key] = int(rest.split()[0])
+        return 1.0 - info["MemAvailable"] / info["MemTotal"]
+    except (OSError, ValueError, KeyError, ZeroDivisionError):
+        return 0.0
+
+
+@dataclass
+class ConcurrencyDecision:
+    at: float  # segundos desde o início do lote
+    old: int
+    new: int
+    reason: str
+    throughput: float  # MB/s (ou trabalhos/s quando os arquivos não têm tamanho)
+    latency: float  # mediana da latência por trabalho na janela, em segundos
+    memory: float  # fração da memória do host em uso
+
+
+class AdaptiveConcurrency:
+    """Ajusta o número de trabalhos simultâneos durante o lote (AIMD).
+
+    A cada janela de trabalhos concluídos compara a vazão com a janela
+    anterior: enquanto ela cresce, soma um trabalho ao limite (aumento
+    aditivo); se cair depois de um aumento, ou se a memória do host passar
+    de memory_limit, reduz o limite multiplicativamente. Em um platô com
+    latência crescente, devolve um trabalho. O limite fica sempre entre
+    floor e ceiling.
+    """
+
+    def __init__(
+        self,
+        floor: int = 1,
+        ceiling: int | None = None,
+        start: int | None = None,
+        memory_limit: float = 0.85,
+        min_window_seconds: float = 1.0,
+    ) -> None:
+        cpus = os.cpu_count() or 1
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling or cpus * 2)
+        self.limit = min(self.ceiling, max(self.floor, start or max(1, cpus // 2)))
+        self.memory_limit = memory_limit
+        self.min_window_seconds = min_window_seconds
+        self.decisions: list[ConcurrencyDecision] = []
+        self._started = time.monotonic()
+        self._window_start = self._started
+        self._window: list[tuple[int, float]] = []
+        self._prev_throughput: float | None = None
+        self._prev_latency: float | None = None
+        self._last_action = "start"
+
+    def record(self, bytes_in: int, elapsed: float) -> int:
+        """Registra um trabalho concluído e devolve o limite (possivelmente novo)."""
+        self._window.append((bytes_in, elapsed))
+        now = time.monotonic()
+        if len(self._window) < max(self.limit, 4) or now - self._window_start < self.min_window_seconds:
+            return self.limit
+        seconds = now - self._window_start
+        total_bytes = sum(b for b, _ in self._window)
+        if total_bytes > 0:
+            throughput = total_bytes / (1024 * 1024) / seconds
+        else:
+            throughput = len(self._window) / seconds
+        latency = statistics.median(e for _, e in self._window)
+        memory = memory_pressure()
+        self._window = []
+        self._window_start = now
+        self._decide(throughput, latency, memory)
+        self._prev_throughput, self._prev_latency = throughput, latency
+        return self.limit
+
+    def _decide(self, throughput: float, latency: float, memory: float) -> None:
+        prev = self._prev_throughput
+        if memory >= self.memory_limit:
+            new, reason, action = int(self.limit * 0.5), "pressão de memória", "decrease"
+        elif prev is None:
+            new, reason, action = self.limit + 1, "sondagem inicial", "increase"
+        elif throughput < prev * 0.9 and self._last_action == "increase":
+            new, reason, action = int(self.limit * 0.75), "vazão caiu após aumento", "decrease"
+        elif throughput > prev * 1.05 or self._last_action != "increase":
+            new, reason, action = self.limit + 1, "vazão em alta" if throughput > prev * 1.05 else "sondagem", "increase"
+        elif self._prev_latency and latency > self._prev_latency * 1.2:
+            new, reason, action = self.limit - 1, "platô com latência crescente", "decrease"
+        else:
+            new, reason, action = self.limit, "platô", "hold"
+        new = min(self.ceiling, max(self.floor, new))
+        self._last_action = action if new != self.limit else "hold"
+        if new == self.limit:
+            return
+        decision = ConcurrencyDecision(
+            at=time.monotonic() - self._started,
+            old=self.limit,
+            new=new,
+            reason=reason,
+            throughput=throughput,
+            latency=latency,
+            memory=memory,
+        )
+        self.decisions.append(decision)
+        self.limit = new
+        print(
+            f"[data-hora-pdf] Concorrência: {decision.old} -> {decision.new} ({reason}; "
+            f"vazão {throughput:.2f}, latência {latency:.2f} s, memória {memory:.0%})"
+        )
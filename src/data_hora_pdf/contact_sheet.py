@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from pathlib import Path
+import io
+import json
+import math
+import unicodedata
+
+try:
+    from PIL import Image, ImageDraw  # type: ignore
+except ImportError:
+    Image = None
+    ImageDraw = None
+
+# Faixa abaixo de cada miniatura com o número da célula (ver index.jsonl)
+_LABEL_HEIGHT = 14
+_GAP = 4
+
+
+def _ascii(text: str) -> str:
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+
+class ContactSheetWriter:
+    """Monta folhas de contato com as miniaturas de conferência do lote.
+
+    As miniaturas chegam na ordem de conclusão e são coladas em uma grade
+    de per_sheet células; cada folha cheia é gravada e liberada da memória
+    (folha_0001.png, folha_0002.png, ...). index.jsonl liga cada célula ao
+    arquivo de origem e à saída, e a célula mostra o mesmo número. Uma
+    observação (ex.: "fora da página") vai para o índice e para a célula;
+    sem miniatura, a célula fica só com a moldura e a observação.
+    """
+
+    def __init__(self, out_dir: str, per_sheet: int = 100, thumb_px: int = 160) -> None:
+        if Image is None:
+            raise RuntimeError("Pillow não disponível para gerar as folhas de contato.")
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.per_sheet = max(1, per_sheet)
+        self.thumb_px = max(16, thumb_px)
+        self.columns = math.ceil(math.sqrt(self.per_sheet))
+        self.sheets = 0
+        self.count = 0
+        self._cells: list[tuple[bytes | None, int, str | None]] = []
+        self._index = open(self.out_dir / "index.jsonl", "w", encoding="utf-8")
+
+    def add(self, png: bytes | None, input_pdf: str, output_pdf: str, note: str | None = None) -> None:
+        self.count += 1
+        cell = len(self._cells)
+        entry = {
+            "number": self.count,
+            "sheet": self._sheet_name(self.sheets + 1),
+            "cell": cell,
+            "row": cell // self.columns,
+            "column": cell % self.columns,
+            "input": input_pdf,
+            "output": output_pdf,
+        }
+        if note:
+            entry["note"] = note
+        self._index.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._cells.append((png, self.count, note))
+        if len(self._cells) >= self.per_sheet:
+            self._flush()
+
+    def close(self) -> list[str]:
+        """Grava a última folha (parcial) e devolve a lista de folhas geradas."""
+        if self._cells:
+            self._flush()
+        self._index.close()
+        return [str(self.out_dir / self._sheet_name(n)) for n in range(1, self.sheets + 1)]
+
+    @staticmethod
+    def _sheet_name(number: int) -> str:
+        return f"folha_{number:04d}.png"
+
+    def _flush(self) -> None:
+        cell_w = self.thumb_px + _GAP
+        cell_h = self.thumb_px + _LABEL_HEIGHT + _GAP
+        rows = math.ceil(len(self._cells) / self.columns)
+        sheet = Image.new("RGB", (self.columns * cell_w + _GAP, rows * cell_h + _GAP), "white")
+        draw = ImageDraw.Draw(sheet)
+        for cell, (png, number, note) in enumerate(self._cells):
+            x = _GAP + (cell % self.columns) * cell_w
+            y = _GAP + (cell // self.columns) * cell_h
+            if png is None:
+                draw.rectangle((x, y, x + self.thumb_px - 1, y + self.thumb_px - 1), outline="#cc0000")
+            else:
+                with Image.open(io.BytesIO(png)) as thumb:
+                    thumb.thumbnail((self.thumb_px, self.thumb_px))
+                    # Centralizada na célula, com moldura para separar de vizinhas brancas
+                    left = x + (self.thumb_px - thumb.width) // 2
+                    top = y + (self.thumb_px - thumb.height) // 2
+                    sheet.paste(thumb.convert("RGB"), (left, top))
+                    draw.rectangle((left - 1, top - 1, left + thumb.width, top + thumb.height), outline="#999999")
+            # A fonte padrão do Pillow não tem acentos: a célula mostra a observação sem eles
+            label = f"{number} ({_ascii(note)})" if note else str(number)
+            draw.text((x, y + self.thumb_px + 1), label, fill="#cc0000" if note else "black")
+        self.sheets += 1
+        sheet.save(self.out_dir / self._sheet_name(self.sheets), optimize=True)
+        self._cells = []
+        self._index.flush()
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from pathlib import Path
+import hashlib
+import json
+
+import fitz  # PyMuPDF
+
+
+@dataclass
+class PasswordEntry:
+    password: str
+    pattern: str | None = None  # glob sobre o caminho (ou só o nome, se não tiver "/")
+    sha256: str | None = None  # impressão digital do arquivo (conteúdo)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _match_segments(pattern: list[str], parts: list[str]) -> bool:
+    """Casa o padrão com o caminho inteiro, segmento a segmento.
+
+    "*" e "?" não atravessam "/"; "**" sozinho em um segmento vale por
+    qualquer quantidade de pastas (inclusive nenhuma).
+    """
+    if not pattern:
+        return not parts
+    head, rest = pattern[0], pattern[1:]
+    if head == "**":
+        return any(_match_segments(rest, parts[skip:]) for skip in range(len(parts) + 1))
+    return bool(parts) and fnmatchcase(parts[0], head) and _match_segments(rest, parts[1:])
+
+
+class PasswordMap:
+    """Senhas de entradas encriptadas, por padrão de caminho ou impressão digital.
+
+    O arquivo é JSON Lines, uma regra por linha:
+        {"pattern": "contratos/**/*.pdf", "password": "..."}
+        {"sha256": "9f86d0...", "password": "..."}
+    Padrões relativos casam com o final do caminho, pasta a pasta: "*"
+    não atravessa "/" e "**" vale por qualquer profundidade. Padrões são
+    testados na ordem do arquivo (o primeiro vence); a
+    impressão digital só é calculada para arquivos que de fato pedem senha
+    e que nenhum padrão cobriu.
+    """
+
+    def __init__(self, entries: list[PasswordEntry]) -> None:
+        self.patterns = [e for e in entries if e.pattern]
+        self.fingerprints = {e.sha256.lower(): e.password for e in entries if e.sha256}
+
+    @classmethod
+    def load(cls, path: str) -> PasswordMap:
+        entries: list[PasswordEntry] = []
+        with open(path, "r", encoding="utf-8") as f:
+            for lineno, raw in enumerate(f, start=1):
+                raw = raw.strip()
+                if not raw or raw.startswith("#"):
+                    continue
+                try:
+                    data = json.loads(raw)
+                    entry = PasswordEntry(password=data["password"], pattern=data.get("pattern"), sha256=data.get("sha256"))
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"Mapa de senhas {path}, linha {lineno}: entrada inválida ({e})") from e
+                if not entry.pattern and not entry.sha256:
+                    raise ValueError(f"Mapa de senhas {path}, linha {lineno}: informe \"pattern\" ou \"sha256\"")
+                entries.append(entry)
+        return cls(entries)
+
+    def _match_pattern(self, path: str) -> str | None:
+        parts = [p for p in Path(path).as_posix().split("/") if p]
+        for entry in self.patterns:
+            pattern = entry.pattern or ""
+            segments = [p for p in pattern.split("/") if p]
+            if pattern.startswith("/"):
+                # Absoluto: casa a partir da raiz
+                matched = Path(path).is_absolute() and _match_segments(segments, parts)
+            else:
+                # Relativo: casa o final do caminho, pasta a pasta (sem "/" = só o nome)
+                matched = any(_match_segments(segments, parts[start:]) for start in range(len(parts)))
+            if matched:
+                return entry.password
+        return None
+
+    def password_for(self, path: str) -> str | None:
+        """Senha para o arquivo em path (None se o mapa não tiver nenhuma)."""
+        password = self._match_pattern(path)
+        if password is not None or not self.fingerprints:
+            return password
+        try:
+            doc = fitz.open(path)
+            try:
+                needs_pass = bool(doc.needs_pass)
+            finally:
+                doc.close()
+            return self.fingerprints.get(file_sha256(path)) if needs_pass else None
+        except Exception:
+            return None
+
+    def password_for_bytes(self, path: str, data: bytes) -> str | None:
+        """Como password_for, com o conteúdo já lido (sem reabrir o arquivo)."""
+        password = self._match_pattern(path)
+        if password is not None or not self.fingerprints:
+            return password
+        return self.fingerprints.get(hashlib.sha256(data).hexdigest())
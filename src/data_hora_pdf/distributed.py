@@ -0,0 +1,336 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import asdict, fields
+from datetime import datetime
+from pathlib import Path
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING, Iterable
+
+from .batch import BatchJob, JobResult, run_protect_job, run_stamp_job
+from .stamper import StampOptions, _resolve_logo_path
+
+if TYPE_CHECKING:
+    from .metrics import BatchMetrics
+    from .credentials import PasswordMap
+    from .profiling import ProfileSettings
+
+# Fila em diretório compartilhado (NFS ou local), sem broker:
+#   pending/<id>.json   trabalho aguardando
+#   leases/<id>.lease   posse do trabalho por um nó (mtime = último heartbeat)
+#   done/<id>.json      resultado publicado
+#   failed/<id>.json    resultado com falha
+_DIRS = ("pending", "leases", "done", "failed")
+# Senhas nunca vão para a fila: o trabalho só registra que precisa delas e
+# cada nó as fornece localmente (--password-map, --input-password, --protection-password, --open-password)
+_SECRET_OPTIONS = ("input_password", "protection_password", "open_password")
+# Caminhos gravados absolutos: os nós não compartilham o diretório atual de quem publicou
+_PATH_OPTIONS = ("logo_path", "font_file")
+
+
+def _ensure_dirs(queue_dir: Path) -> None:
+    for name in _DIRS:
+        (queue_dir / name).mkdir(parents=True, exist_ok=True)
+
+
+def _write_atomic(path: Path, data: dict) -> None:
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _job_to_dict(job: BatchJob, mode: str) -> dict:
+    options = asdict(job.options)
+    # Só as senhas de fato informadas saem; open_password="" (remover a senha) não é segredo
+    secrets = [name for name in _SECRET_OPTIONS if options.get(name)]
+    for name in secrets:
+        del options[name]
+    if mode == "stamp":
+        # Logo resolvido aqui, como na execução local: senão cada nó procuraria o
+        # Logo.jpg padrão no próprio diretório (e poderia usar outro logo, ou nenhum)
+        logo = _resolve_logo_path(job.options, job.input_pdf)
+        options["logo_path"] = str(logo) if logo is not None else None
+        options["use_logo"] = logo is not None
+    for name in _PATH_OPTIONS:
+        if options.get(name):
+            options[name] = os.path.abspath(options[name])
+    return {
+        "mode": mode,
+        "input": os.path.abspath(job.input_pdf),
+        "output": os.path.abspath(job.output_pdf),
+        "cidade": job.cidade,
+        "date": job.d.strftime("%d/%m/%Y") if job.d else None,
+        "options": options,
+        "secrets": secrets,
+    }
+
+
+def _job_from_dict(data: dict) -> BatchJob:
+    names = {f.name for f in fields(StampOptions)}
+    options = StampOptions(**{k: v for k, v in data.get("options", {}).items() if k in names})
+    d = datetime.strptime(data["date"], "%d/%m/%Y").date() if data.get("date") else None
+    return BatchJob(data["input"], data["output"], data.get("cidade", ""), d, options)
+
+
+def enqueue(queue_dir: str, jobs: Iterable[BatchJob], mode: str = "stamp") -> int:
+    """Publica trabalhos na fila (um arquivo por trabalho). Retorna a quantidade.
+
+    Caminhos são gravados absolutos; senhas não são gravadas (ver _SECRET_OPTIONS).
+    """
+    root = Path(queue_dir)
+    _ensure_dirs(root)
+    count = 0
+    for job in jobs:
+        job_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        _write_atomic(root / "pending" / f"{job_id}.json", _job_to_dict(job, mode))
+        count += 1
+    return count
+
+
+def queue_status(queue_dir: str) -> dict[str, int]:
+    root = Path(queue_dir)
+    return {name: len(list((root / name).glob("*.json" if name != "leases" else "*.lease"))) for name in _DIRS}
+
+
+class _LeaseManager:
+    """Posse de trabalhos via arquivos de lease com heartbeat e expiração.
+
+    A criação usa O_CREAT|O_EXCL (atômica também em NFS v3+). Um lease cujo
+    mtime não é renovado há mais de ttl segundos é considerado abandonado e
+    pode ser retomado por outro nó: ele é renomeado para um nome único (só
+    um nó vence a corrida) e removido antes da nova tentativa.
+    """
+
+    def __init__(self, root: Path, node_id: str, ttl: float) -> None:
+        self.root = root
+        self.node_id = node_id
+        self.ttl = ttl
+        self._held: set[Path] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat_loop, name="lease-heartbeat", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=self.ttl)
+
+    def _path(self, job_id: str) -> Path:
+        return self.root / "leases" / f"{job_id}.lease"
+
+    def _is_expired(self, lease: Path) -> bool:
+        try:
+            return time.time() - lease.stat().st_mtime > self.ttl
+        except FileNotFoundError:
+            return False
+
+    def try_acquire(self, job_id: str) -> bool:
+        lease = self._path(job_id)
+        for _attempt in range(2):
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._is_expired(lease):
+                    return False
+                # Retomar lease expirado de um nó que parou
+                stale = lease.with_name(f"{lease.name}.stale-{self.node_id}-{uuid.uuid4().hex[:6]}")
+                try:
+                    os.replace(lease, stale)
+                except FileNotFoundError:
+                    continue
+                if not self._is_expired(stale):
+                    # Outro nó retomou o lease entre a verificação e o rename: devolver
+                    try:
+                        os.link(stale, lease)
+                    except OSError:
+                        pass
+                    stale.unlink(missing_ok=True)
+                    return False
+                stale.unlink(missing_ok=True)
+                print(f"[data-hora-pdf] Lease expirado retomado: {job_id}")
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"node": self.node_id, "acquired": time.time(), "ttl": self.ttl}, f)
+            with self._lock:
+                self._held.add(lease)
+            return True
+        return False
+
+    def still_owner(self, job_id: str) -> bool:
+        try:
+            data = json.loads(self._path(job_id).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return False
+        return data.get("node") == self.node_id
+
+    def release(self, job_id: str) -> None:
+        lease = self._path(job_id)
+        with self._lock:
+            self._held.discard(lease)
+        if self.still_owner(job_id):
+            try:
+                lease.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _heartbeat_loop(self) -> None:
+        interval = max(self.ttl / 3.0, 0.5)
+        while not self._stop.wait(interval):
+            with self._lock:
+                held = list(self._held)
+            for lease in held:
+                try:
+                    os.utime(lease, None)
+                except FileNotFoundError:
+                    pass
+
+
+def _run_queued_job(
+    data: dict,
+    profile: ProfileSettings | None = None,
+    passwords: PasswordMap | None = None,
+    secrets: dict[str, str] | None = None,
+) -> JobResult:
+    job = _job_from_dict(data)
+    final_output = job.output_pdf
+    secrets = secrets or {}
+    for name in data.get("secrets", []):
+        if secrets.get(name):
+            setattr(job.options, name, secrets[name])
+        elif name != "input_password":
+            # Sem a senha o nó gravaria a saída sem a proteção pedida
+            return JobResult(
+                job.input_pdf,
+                final_output,
+                status="failed",
+                error=f"Trabalho pede {name}; informe --{name.replace('_', '-')} no nó.",
+                reason="missing_password",
+            )
+        # input_password ausente: o mapa de senhas do nó (passwords) é consultado ao abrir
+    same = False
+    try:
+        same = Path(job.input_pdf).resolve() == Path(final_output).resolve()
+    except Exception:
+        pass
+    if not same:
+        # Gravar em arquivo temporário e publicar com rename atômico
+        target = Path(final_output)
+        job.output_pdf = str(target.with_name(f".{target.name}.{os.getpid()}.part"))
+    worker = run_protect_job if data.get("mode") == "protect" else run_stamp_job
+    result = worker(job, profile, artifact_for=final_output, passwords=passwords)
+    if not same:
+        tmp = Path(job.output_pdf)
+        if result.status in ("stamped", "protected") and tmp.exists():
+            os.replace(tmp, final_output)
+        elif tmp.exists():
+            tmp.unlink()
+        result.output_pdf = final_output
+    return result
+
+
+def run_node(
+    queue_dir: str,
+    node_id: str | None = None,
+    max_workers: int | None = None,
+    lease_ttl: float = 60.0,
+    poll_interval: float = 2.0,
+    keep_running: bool = False,
+    metrics: BatchMetrics | None = None,
+    profile: ProfileSettings | None = None,
+    passwords: PasswordMap | None = None,
+    secrets: dict[str, str] | None = None,
+) -> list[JobResult]:
+    """Processa trabalhos da fila compartilhada até esvaziá-la (ou indefinidamente).
+
+    Vários nós (máquinas ou processos locais) podem rodar ao mesmo tempo
+    sobre o mesmo diretório; cada trabalho é executado por um único nó,
+    salvo quando o lease expira (nó parado), caso em que é retomado.
+    Com profile, trabalhos lentos ou amostrados deixam um artefato de perfil.
+    passwords é o mapa de senhas local do nó e secrets as senhas locais
+    (input_password, protection_password, open_password) para os trabalhos que as pedem;
+    nenhum dos dois vai para a fila.
+    """
+    root = Path(queue_dir)
+    _ensure_dirs(root)
+    node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+    max_workers = max(1, max_workers or os.cpu_count() or 1)
+    leases = _LeaseManager(root, node_id, lease_ttl)
+    leases.start()
+    results: list[JobResult] = []
+    inflight: dict[Future, str] = {}
+    # Candidatos de uma única listagem de pending/, consumidos até acabar: a pasta
+    # só é listada de novo quando a lista esvazia (não a cada trabalho reservado)
+    backlog: deque[Path] = deque()
+
+    def claim_next() -> tuple[str, dict] | None:
+        if not backlog:
+            backlog.extend(sorted((root / "pending").glob("*.json")))
+            if metrics is not None:
+                metrics.set_queue_depth(len(backlog))
+        while backlog:
+            pending = backlog.popleft()
+            job_id = pending.stem
+            if (root / "done" / pending.name).exists() or (root / "failed" / pending.name).exists():
+                continue
+            if job_id in inflight.values() or not leases.try_acquire(job_id):
+                continue
+            try:
+                return job_id, json.loads(pending.read_text(encoding="utf-8"))
+            except FileNotFoundError:
+                # Concluído por outro nó entre a listagem e o lease
+                leases.release(job_id)
+            except ValueError as e:
+                _write_atomic(root / "failed" / pending.name, {"input": None, "status": "failed", "error": f"Trabalho inválido: {e}", "node": node_id})
+                pending.unlink(missing_ok=True)
+                leases.release(job_id)
+        return None
+
+    def publish(job_id: str, result: JobResult) -> None:
+        if not leases.still_owner(job_id):
+            print(f"[data-hora-pdf] Aviso: lease de {job_id} perdido; publicando mesmo assim (saída idempotente)")
+        folder = "failed" if result.status == "failed" else "done"
+        payload = asdict(result)
+        payload.pop("thumbnail", None)  # bytes: folhas de contato só no lote local
+        payload["node"] = node_id
+        _write_atomic(root / folder / f"{job_id}.json", payload)
+        (root / "pending" / f"{job_id}.json").unlink(missing_ok=True)
+        leases.release(job_id)
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            while True:
+                while len(inflight) < max_workers:
+                    claimed = claim_next()
+                    if claimed is None:
+                        break
+                    job_id, data = claimed
+                    inflight[pool.submit(_run_queued_job, data, profile, passwords, secrets)] = job_id
+                if not inflight:
+                    if not keep_running:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+                finished, _ = wait(list(inflight), timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job_id = inflight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = JobResult("", "", status="failed", error=f"{type(e).__name__}: {e}", reason="error")
+                    publish(job_id, result)
+                    results.append(result)
+                    if metrics is not None:
+                        metrics.observe(result)
+    finally:
+        leases.stop()
+        if metrics is not None:
+            metrics.flush(force=True)
+    return results
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+# Imagens digitalizadas aceitas como entrada (convertidas para PDF em memória)
+IMAGE_SUFFIXES = (".tif", ".tiff", ".jpg", ".jpeg", ".png")
+
+
+def is_image_input(path: str) -> bool:
+    return Path(path).suffix.lower() in IMAGE_SUFFIXES
+
+
+def image_to_pdf_bytes(data: bytes, filename: str) -> bytes:
+    """Converte uma imagem (TIFF de várias páginas, JPEG, PNG) em PDF, em memória.
+
+    Cada quadro do TIFF vira uma página e é decodificado sozinho, então um
+    arquivo de centenas de páginas nunca fica inteiro descomprimido. JPEG
+    entra no PDF sem recompressão (DCTDecode); o tamanho da página segue a
+    resolução (DPI) gravada na imagem.
+    """
+    src = fitz.open(stream=data, filetype=Path(filename).suffix.lstrip(".").lower() or "png")
+    out = fitz.open()
+    try:
+        for i in range(src.page_count):
+            frame = fitz.open("pdf", src.convert_to_pdf(i, i))
+            try:
+                out.insert_pdf(frame)
+            finally:
+                frame.close()
+        # Fluxos já vêm comprimidos de convert_to_pdf: sem recompressão aqui
+        return out.tobytes()
+    finally:
+        out.close()
+        src.close()
+
+
+def pdf_output_path(path: str) -> str:
+    """Caminho do PDF gerado para uma entrada de imagem (mesmo nome, extensão .pdf)."""
+    return str(Path(path).with_suffix(".pdf"))
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import os
+import threading
+import time
+
+# Limites dos histogramas de latência (segundos)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...], lock: threading.Lock) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = lock
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_fmt(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(*args)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # por conjunto de labels: [contagens por bucket..., soma, total]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, row in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, row):
+                le = 'le="' + _fmt(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {_fmt(count)}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(row[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {_fmt(row[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registro de métricas no formato texto do Prometheus."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: list[_Metric] = []
+
+    def counter(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help_text, labelnames, self._lock))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self._add(Gauge(name, help_text, labelnames, self._lock))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labelnames, self._lock, buckets=buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            lines: list[str] = []
+            for metric in self._metrics:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """Grava de forma atômica (para o textfile collector do node_exporter)."""
+        target = Path(path)
+        tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        tmp.write_text(self.render(), encoding="utf-8")
+        tmp.replace(target)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Expõe /metrics em um servidor HTTP local (thread em segundo plano)."""
+        registry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # noqa: N802
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_args) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), _Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+
+class BatchMetrics:
+    """Métricas do pipeline de carimbo, alimentadas pelos resultados dos trabalhos."""
+
+    def __init__(self, registry: MetricsRegistry | None = None, textfile: str | None = None, interval: float = 5.0) -> None:
+        self.registry = registry or MetricsRegistry()
+        self.textfile = textfile
+        self.interval = interval
+        self._last_write = 0.0
+        r = self.registry
+        self.jobs = r.counter("data_hora_pdf_jobs_total", "Trabalhos concluídos por status.", ("status",))
+        self.problems = r.counter(
+            "data_hora_pdf_job_problems_total",
+            "Degradações e falhas por motivo (font_fallback, protection_fallback, logo_failure, missing_page, ...).",
+            ("reason",),
+        )
+        self.job_seconds = r.histogram("data_hora_pdf_job_seconds", "Latência total por trabalho.")
+        self.phase_seconds = r.histogram("data_hora_pdf_phase_seconds", "Latência por fase de stamp_pdf.", ("phase",))
+        self.bytes_in = r.counter("data_hora_pdf_bytes_in_total", "Bytes lidos dos PDFs de entrada.")
+        self.bytes_out = r.counter("data_hora_pdf_bytes_out_total", "Bytes gravados nos PDFs de saída.")
+        self.queue_depth = r.gauge("data_hora_pdf_queue_depth", "Trabalhos aguardando ou em execução.")
+        self.worker_rss = r.gauge("data_hora_pdf_worker_rss_bytes", "Memória residente de cada processo de trabalho.", ("worker",))
+        self.concurrency = r.gauge("data_hora_pdf_concurrency", "Trabalhos simultâneos permitidos (ajustado com --jobs auto).")
+
+    def observe(self, result) -> None:
+        """Registra um JobResult (ver batch.py)."""
+        self.jobs.inc(status=result.status)
+        for event in result.events:
+            self.problems.inc(reason=event)
+        if result.status == "failed":
+            self.problems.inc(reason=result.reason or "error")
+        self.job_seconds.observe(result.elapsed)
+        for phase, seconds in result.timings.items():
+            self.phase_seconds.observe(seconds, phase=phase)
+        self.bytes_in.inc(result.bytes_in)
+        self.bytes_out.inc(result.bytes_out)
+        if result.worker_pid:
+            self.worker_rss.set(result.rss_bytes, worker=str(result.worker_pid))
+        self.flush()
+
+    def set_queue_depth(self, depth: int) -> None:
+        self.queue_depth.set(depth)
+
+    def set_concurrency(self, limit: int) -> None:
+        self.concurrency.set(limit)
+
+    def flush(self, force: bool = False) -> None:
+        if not self.textfile:
+            return
+        now = time.monotonic()
+        if force or now - self._last_write >= self.interval:
+            self._last_write = now
+            self.registry.write_textfile(self.textfile)
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import replace
+from pathlib import Path
+import os
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+from .batch import BatchJob, JobResult, _fail, _file_size, _finish, _write_bytes
+from .ingest import image_to_pdf_bytes, is_image_input
+from .stamper import protect_pdf_bytes, stamp_pdf_bytes
+
+if TYPE_CHECKING:
+    from .credentials import PasswordMap
+    from .metrics import BatchMetrics
+
+# Executor em três estágios para entradas/saídas em armazenamento lento (rede):
+#   leitura antecipada (threads) -> carimbo em memória (processos) -> gravação (threads)
+# O orçamento de bytes limita quanto fica em memória entre a leitura e a
+# gravação; leitores esperam quando ele se esgota (contrapressão).
+
+
+class _ByteBudget:
+    """Semáforo em bytes. Um item maior que o limite passa sozinho."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self.used = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def acquire(self, n: int) -> bool:
+        with self._cond:
+            while not self._closed and self.used > 0 and self.used + n > self.limit:
+                self._cond.wait()
+            if self._closed:
+                return False
+            self.used += n
+            return True
+
+    def release(self, n: int) -> None:
+        with self._cond:
+            self.used -= n
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+def _as_pdf(job: BatchJob, data: bytes, timings: dict[str, float]) -> bytes:
+    # Imagens digitalizadas (TIFF/JPEG) viram PDF aqui, no processo de carimbo
+    if not is_image_input(job.input_pdf):
+        return data
+    t_phase = time.perf_counter()
+    pdf = image_to_pdf_bytes(data, job.input_pdf)
+    timings["ingest"] = time.perf_counter() - t_phase
+    return pdf
+
+
+def _with_password(job: BatchJob, data: bytes, passwords: PasswordMap | None) -> BatchJob:
+    # Como batch._with_password, mas a impressão digital usa os bytes já lidos
+    if passwords is None or job.options.input_password:
+        return job
+    password = passwords.password_for_bytes(job.input_pdf, data)
+    if password is None:
+        return job
+    return replace(job, options=replace(job.options, input_password=password))
+
+
+def _stamp_bytes_job(job: BatchJob, data: bytes, passwords: PasswordMap | None = None) -> tuple[JobResult, bytes | None]:
+    started = time.perf_counter()
+    result = JobResult(job.input_pdf, job.output_pdf, status="failed", bytes_in=len(data))
+    out = None
+    try:
+        job = _with_password(job, data, passwords)
+        ingest: dict[str, float] = {}
+        data = _as_pdf(job, data, ingest)
+        stamped, out = stamp_pdf_bytes(data, job.cidade, job.d, job.options, source=job.input_pdf)
+        result.status = stamped.status
+        result.timings = {**ingest, **stamped.timings}
+        result.events = stamped.events
+        result.thumbnail = stamped.thumbnail
+    except Exception as e:
+        _fail(result, e)
+    return _finish(result, started), out
+
+
+def _protect_bytes_job(job: BatchJob, data: bytes, passwords: PasswordMap | None = None) -> tuple[JobResult, bytes | None]:
+    started = time.perf_counter()
+    result = JobResult(job.input_pdf, job.output_pdf, status="failed", bytes_in=len(data))
+    out = None
+    try:
+        job = _with_password(job, data, passwords)
+        data = _as_pdf(job, data, result.timings)
+        out = protect_pdf_bytes(data, job.options, source=job.input_pdf)
+        result.status = "protected"
+    except Exception as e:
+        _fail(result, e)
+    return _finish(result, started), out
+
+
+def run_pipeline(
+    jobs: Iterable[BatchJob],
+    mode: str = "stamp",
+    read_workers: int = 4,
+    stamp_workers: int | None = None,
+    write_workers: int = 4,
+    prefetch_bytes: int = 256 * 1024 * 1024,
+    metrics: BatchMetrics | None = None,
+    passwords: PasswordMap | None = None,
+) -> Iterator[JobResult]:
+    """Executa o lote com leitura antecipada e gravação em segundo plano.
+
+    Cada estágio tem a própria concorrência; o carimbo trabalha sobre os
+    bytes já lidos, então a rede e os processadores ficam ocupados ao mesmo
+    tempo. Os resultados saem à medida que a gravação termina, com as fases
+    "read" e "write" incluídas em timings.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return
+    stage = _protect_bytes_job if mode == "protect" else _stamp_bytes_job
+    stamp_workers = max(1, min(stamp_workers or os.cpu_count() or 1, len(jobs)))
+    budget = _ByteBudget(prefetch_bytes)
+    done: queue.Queue[JobResult] = queue.Queue()
+    readers = ThreadPoolExecutor(max_workers=max(1, read_workers), thread_name_prefix="prefetch")
+    writers = ThreadPoolExecutor(max_workers=max(1, write_workers), thread_name_prefix="write-behind")
+    stampers = ProcessPoolExecutor(max_workers=stamp_workers)
+
+    def failed(job: BatchJob, exc: Exception, reserved: int, extra: float = 0.0) -> None:
+        result = JobResult(job.input_pdf, job.output_pdf, status="failed", bytes_in=reserved)
+        _fail(result, exc)
+        result.elapsed = extra
+        budget.release(reserved)
+        done.put(result)
+
+    def write(job: BatchJob, reserved: int, result: JobResult, out: bytes) -> None:
+        t_phase = time.perf_counter()
+        try:
+            Path(job.output_pdf).parent.mkdir(parents=True, exist_ok=True)
+            _write_bytes(job.output_pdf, out)
+            result.bytes_out = len(out)
+        except Exception as e:
+            _fail(result, e)
+        result.timings["write"] = time.perf_counter() - t_phase
+        result.elapsed += result.timings["write"]
+        budget.release(reserved)
+        done.put(result)
+
+    def stamped(job: BatchJob, reserved: int, read_seconds: float, future: Future) -> None:
+        # Chamado na thread de gerenciamento do pool: só encaminha
+        try:
+            result, out = future.result()
+        except Exception as e:
+            failed(job, e, reserved, read_seconds)
+            return
+        result.timings["read"] = read_seconds
+        result.elapsed += read_seconds
+        if out is None:
+            budget.release(reserved)
+            done.put(result)
+            return
+        try:
+            writers.submit(write, job, reserved, result, out)
+        except RuntimeError as e:  # executor encerrado (lote interrompido)
+            failed(job, e, reserved)
+
+    def read(job: BatchJob) -> None:
+        reserved = _file_size(job.input_pdf)
+        if not budget.acquire(reserved):
+            return
+        t_phase = time.perf_counter()
+        try:
+            data = Path(job.input_pdf).read_bytes()
+        except Exception as e:
+            failed(job, e, reserved, time.perf_counter() - t_phase)
+            return
+        read_seconds = time.perf_counter() - t_phase
+        try:
+            future = stampers.submit(stage, job, data, passwords)
+        except RuntimeError as e:
+            failed(job, e, reserved, read_seconds)
+            return
+        future.add_done_callback(lambda f: stamped(job, reserved, read_seconds, f))
+
+    pending = len(jobs)
+    if metrics is not None:
+        metrics.set_queue_depth(pending)
+    for job in jobs:
+        readers.submit(read, job)
+    try:
+        while pending:
+            result = done.get()
+            pending -= 1
+            if metrics is not None:
+                metrics.set_queue_depth(pending)
+                metrics.observe(result)
+            yield result
+    finally:
+        budget.close()
+        readers.shutdown(cancel_futures=True)
+        stampers.shutdown(cancel_futures=True)
+        writers.shutdown()
+        if metrics is not None:
+            metrics.flush(force=True)
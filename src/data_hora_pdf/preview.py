@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+import queue
+import threading
+
+import fitz  # PyMuPDF
+
+
+@dataclass
+class RenderedPage:
+    path: str
+    page: int
+    zoom: float
+    png: bytes  # imagem da página em baixa resolução (PNG)
+    page_width: float  # tamanho da página em pontos
+    page_height: float
+    page_count: int
+
+
+class PageCache:
+    """Cache LRU limitado de páginas renderizadas, por (arquivo, mtime, página, área).
+
+    A área de exibição (em pixels) determina o zoom de forma única.
+    """
+
+    def __init__(self, max_entries: int = 16) -> None:
+        self.max_entries = max_entries
+        self._items: OrderedDict[tuple, RenderedPage] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path: str, page: int, box: tuple[int, int]) -> tuple:
+        try:
+            mtime = Path(path).stat().st_mtime_ns
+        except OSError:
+            mtime = 0
+        return (str(Path(path).resolve()), mtime, page, box)
+
+    def get(self, key: tuple) -> RenderedPage | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+            return item
+
+    def put(self, key: tuple, item: RenderedPage) -> None:
+        with self._lock:
+            self._items[key] = item
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+
+def render_page(path: str, page: int, box: tuple[int, int]) -> RenderedPage:
+    """Renderiza a página no maior zoom que caiba em box (largura, altura em pixels)."""
+    doc = fitz.open(path)
+    try:
+        if page < 0 or page >= len(doc):
+            raise IndexError(f"Página {page} não existe no PDF (total {len(doc)}).")
+        pg = doc[page]
+        zoom = min(box[0] / pg.rect.width, box[1] / pg.rect.height)
+        pix = pg.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return RenderedPage(path, page, zoom, pix.tobytes("png"), pg.rect.width, pg.rect.height, len(doc))
+    finally:
+        doc.close()
+
+
+class PreviewRenderer:
+    """Renderiza páginas em uma thread de fundo, sem bloquear a interface.
+
+    request() só guarda o pedido mais recente (pedidos antigos são
+    descartados); os resultados são lidos com poll() a partir da thread
+    da interface (Tk não é thread-safe). Resultados de pedidos já
+    superados, que a thread ainda termine de renderizar, são ignorados.
+    """
+
+    def __init__(self, cache: PageCache | None = None) -> None:
+        self.cache = cache or PageCache()
+        self._requests: queue.Queue = queue.Queue(maxsize=1)
+        self._results: queue.Queue = queue.Queue()
+        self._pending: tuple | None = None  # chave do pedido mais recente ainda sem resultado
+        self._thread = threading.Thread(target=self._loop, name="preview-render", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> bool:
+        """Há um pedido aguardando resultado (continuar chamando poll())."""
+        return self._pending is not None
+
+    def request(self, path: str, page: int, box: tuple[int, int]) -> RenderedPage | None:
+        """Devolve a página do cache imediatamente ou agenda a renderização."""
+        key = PageCache.key(path, page, box)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._pending = None
+            return cached
+        try:
+            self._requests.get_nowait()
+        except queue.Empty:
+            pass
+        self._pending = key
+        self._requests.put_nowait((key, path, page, box))
+        return None
+
+    def poll(self) -> RenderedPage | Exception | None:
+        """Resultado do pedido mais recente, ou None se ainda não chegou."""
+        found: RenderedPage | Exception | None = None
+        while True:
+            try:
+                key, item = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if key == self._pending:
+                found = item
+        if found is not None:
+            self._pending = None
+        return found
+
+    def _loop(self) -> None:
+        while True:
+            key, path, page, box = self._requests.get()
+            try:
+                item = self.cache.get(key) or render_page(path, page, box)
+                self.cache.put(key, item)
+                self._results.put((key, item))
+            except Exception as e:
+                self._results.put((key, e))
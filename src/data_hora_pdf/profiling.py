@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, replace
+from pathlib import Path
+import cProfile
+import hashlib
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import zlib
+from typing import Any, Callable
+
+import fitz  # PyMuPDF
+
+from .stamper import StampOptions
+
+
+@dataclass
+class ProfileSettings:
+    """Perfil sob demanda nos trabalhos em lote/fila.
+
+    - latency_seconds: trabalho mais lento que isso é repetido sob cProfile
+    - memory_mb: trabalho cujo pico de memória residente passa a memória do
+      início do próprio trabalho em mais que isso é repetido sob tracemalloc
+    - sample_every: 1 de cada N trabalhos é executado já sob cProfile
+      (escolha determinística pelo caminho de entrada; 0 = desligado)
+    - artifact_dir: pasta dos artefatos (padrão: ao lado da saída)
+    """
+
+    latency_seconds: float | None = None
+    memory_mb: float | None = None
+    sample_every: int = 0
+    artifact_dir: str | None = None
+
+    def is_sampled(self, key: str) -> bool:
+        if self.sample_every <= 0:
+            return False
+        # Hash bem distribuído: nomes sequenciais (doc001, doc002...) não caem juntos
+        digest = hashlib.sha1(key.encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") % self.sample_every == 0
+
+
+def _read_hwm() -> int | None:
+    # Pico de memória residente desde o último reset (Linux: VmHWM em KiB)
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _reset_hwm() -> bool:
+    # "5" zera o VmHWM do processo (Linux 4.0+); False onde não existe
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return _read_hwm() is not None
+
+
+def measure_peak(call: Callable[[], Any], interval: float = 0.02) -> tuple[Any, int]:
+    """Executa call e devolve (valor, crescimento do pico de memória em bytes).
+
+    O crescimento é medido a partir da memória residente no início do
+    trabalho, não do pico acumulado do processo: no Linux o pico é zerado
+    antes de call; nos demais sistemas a memória atual é amostrada em uma
+    thread durante a execução.
+    """
+    from .batch import _current_rss
+
+    start = _current_rss()
+    if _reset_hwm():
+        value = call()
+        return value, max(0, (_read_hwm() or start) - start)
+    peak = [start]
+    done = threading.Event()
+
+    def sample() -> None:
+        while not done.wait(interval):
+            peak[0] = max(peak[0], _current_rss())
+
+    sampler = threading.Thread(target=sample, name="profile-rss", daemon=True)
+    sampler.start()
+    try:
+        value = call()
+    finally:
+        done.set()
+        sampler.join()
+    return value, max(0, max(peak[0], _current_rss()) - start)
+
+
+def _mupdf_state() -> dict:
+    return {"mupdf_warnings": [w for w in fitz.TOOLS.mupdf_warnings().splitlines() if w]}
+
+
+def _capture(kind: str, call: Callable[[], Any]) -> tuple[Any, dict, cProfile.Profile | None]:
+    """Executa call sob cProfile ou tracemalloc e devolve (valor, resumo, perfil)."""
+    fitz.TOOLS.reset_mupdf_warnings()
+    profiler: cProfile.Profile | None = None
+    started = time.perf_counter()
+    if kind == "tracemalloc":
+        already = tracemalloc.is_tracing()
+        if not already:
+            tracemalloc.start(25)
+        try:
+            value, rss_growth = measure_peak(call)
+            snapshot = tracemalloc.take_snapshot()
+            _current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if not already:
+                tracemalloc.stop()
+        summary = {
+            "python_peak_bytes": peak,
+            "peak_rss_growth": rss_growth,
+            "top_allocations": [str(stat) for stat in snapshot.statistics("lineno")[:25]],
+        }
+    else:
+        profiler = cProfile.Profile()
+        value, rss_growth = measure_peak(lambda: profiler.runcall(call))
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(30)
+        summary = {"peak_rss_growth": rss_growth, "top_functions": out.getvalue().splitlines()}
+    summary["seconds"] = time.perf_counter() - started
+    summary.update(_mupdf_state())
+    return value, summary, profiler
+
+
+def _artifact_base(settings: ProfileSettings, output_pdf: str) -> Path:
+    target = Path(output_pdf)
+    if settings.artifact_dir:
+        folder = Path(settings.artifact_dir)
+        folder.mkdir(parents=True, exist_ok=True)
+        # Nome único por trabalho mesmo com saídas de mesmo nome em pastas diferentes
+        tag = f"{zlib.crc32(str(target.resolve()).encode('utf-8')):08x}"
+        return folder / f"{target.stem}.{tag}"
+    return target.with_name(target.stem)
+
+
+def _write_artifact(settings: ProfileSettings, output_pdf: str, payload: dict, profiler: cProfile.Profile | None) -> str:
+    base = _artifact_base(settings, output_pdf)
+    if profiler is not None:
+        prof_path = base.with_name(base.name + ".prof")
+        profiler.dump_stats(str(prof_path))
+        payload["pstats_file"] = str(prof_path)
+    json_path = base.with_name(base.name + ".profile.json")
+    json_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    return str(json_path)
+
+
+def run_with_profile(
+    settings: ProfileSettings | None,
+    input_pdf: str,
+    output_pdf: str,
+    options: StampOptions,
+    call: Callable[[str, str, StampOptions], Any],
+    artifact_for: str | None = None,
+) -> tuple[Any, str | None]:
+    """Executa call(entrada, saída, opções) e captura o perfil quando necessário.
+
+    Devolve (valor de call, caminho do artefato ou None). Trabalhos
+    amostrados rodam direto sob cProfile. Os demais rodam normalmente e, se
+    passarem de um limite, são repetidos sob o perfilador com saída
+    temporária (a saída publicada não é tocada); na gravação no próprio
+    arquivo a repetição usa a saída já carimbada com if_stamped="replace".
+    Uma falha na repetição não falha o trabalho: vai para rerun_error no artefato.
+    artifact_for substitui output_pdf no nome e no conteúdo do artefato.
+    """
+    if settings is None:
+        return call(input_pdf, output_pdf, options), None
+
+    published = artifact_for or output_pdf
+    if settings.is_sampled(input_pdf):
+        value, summary, profiler = _capture("cprofile", lambda: call(input_pdf, output_pdf, options))
+        payload = {"input": input_pdf, "output": published, "trigger": "sample", "sample_every": settings.sample_every, **summary}
+        return value, _write_artifact(settings, published, payload, profiler)
+
+    started = time.perf_counter()
+    value, grown = measure_peak(lambda: call(input_pdf, output_pdf, options))
+    elapsed = time.perf_counter() - started
+
+    if settings.latency_seconds is not None and elapsed >= settings.latency_seconds:
+        trigger, kind = "latency", "cprofile"
+    elif settings.memory_mb is not None and grown >= settings.memory_mb * 1024 * 1024:
+        trigger, kind = "memory", "tracemalloc"
+    else:
+        return value, None
+
+    try:
+        same = Path(input_pdf).resolve() == Path(output_pdf).resolve()
+    except Exception:
+        same = False
+    rerun_input, rerun_options = (output_pdf, replace(options, if_stamped="replace")) if same else (input_pdf, options)
+    base = _artifact_base(settings, published)
+    rerun_output = str(base.with_name(f".{base.name}.{os.getpid()}.rerun.pdf"))
+    try:
+        _value, summary, profiler = _capture(kind, lambda: call(rerun_input, rerun_output, rerun_options))
+    except Exception as e:
+        # A saída já foi publicada: falha na repetição fica só no artefato
+        summary, profiler = {"rerun_error": f"{type(e).__name__}: {e}", **_mupdf_state()}, None
+    finally:
+        Path(rerun_output).unlink(missing_ok=True)
+    payload = {
+        "input": input_pdf,
+        "output": published,
+        "trigger": trigger,
+        "first_run_seconds": elapsed,
+        "first_run_peak_rss_growth": grown,
+        "rerun_input": rerun_input,
+        "rerun_if_stamped": rerun_options.if_stamped,
+        **summary,
+    }
+    return value, _write_artifact(settings, published, payload, profiler)
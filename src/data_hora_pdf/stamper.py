@@ -1,12 +1,44 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import date
 from pathlib import Path
+import hashlib
 import io
+import json
+import re
+import threading
+import time
+import zlib
+from typing import Callable, TypeVar
 
 import fitz  # PyMuPDF
 
+from .ingest import image_to_pdf_bytes, is_image_input
+
+# Chave privada gravada no dicionário da página carimbada (ver detect_stamp)
+_MARKER_KEY = "DataHoraPDFStamp"
+# Fontes analisadas (fitz.Font), compartilhadas por todos os carimbos do processo
+_FONT_CACHE: dict[tuple, fitz.Font] = {}
+_FONT_CACHE_LOCK = threading.Lock()
+_FONT_SUFFIXES = (".ttf", ".otf", ".ttc")
+# Logos já preparados (reamostrados/convertidos), por arquivo e tamanho de saída
+_LOGO_CACHE: dict[tuple, "_PreparedLogo"] = {}
+_LOGO_CACHE_LOCK = threading.Lock()
+_VECTOR_LOGO_SUFFIXES = (".pdf", ".svg")
+# Linha de data gerada por data_por_extenso (em maiúsculas), usada na busca de texto
+_DATE_LINE_RE = re.compile(r"\d{1,2} DE [A-ZÇ]+ DE \d{4}\.")
+# Comentário no início dos fluxos de conteúdo gravados pelo carimbo (identifica
+# carimbos anteriores); no modo compacto o fluxo único começa com "q" + esta linha
+_STAMP_TAG = b"% data-hora-pdf"
+_COMPACT_PREFIX = b"q\n" + _STAMP_TAG
+_OBJ_REF_RE = re.compile(r"(\d+) 0 R")
+_STREAM_KEYS_RE = re.compile(r"/(?:Length|Filter|DecodeParms)\s*(?:\[[^\]]*\]|<<.*?>>|/\w+|[\w.]+(?:\s+0\s+R)?)")
+# Nome de recurso usado no conteúdo: "/Nome ... Tf" (fonte) ou "/Nome Do" (imagem/form)
+_RESOURCE_USE_RE = re.compile(rb"/([^\s/\[\]<>(){}%]+)\s+(?:Do\b|[\d.]+\s+Tf\b)")
+
+_T = TypeVar("_T")
+
 
 @dataclass
 class StampOptions:
@@ -19,18 +51,67 @@ class StampOptions:
     bold: bool = False
     italic: bool = False
     margin: float = 36.0  # 0.5in
+    font_file: str | None = None  # arquivo TTF/OTF (tem prioridade sobre "font")
     # Logo
     logo_path: str | None = None
+    use_logo: bool = True  # False = sem logo (nem o Logo.jpg padrão)
     logo_width_cm: float = 2.0
     logo_margin_cm: float = 0.5
+    logo_dpi: float = 300.0  # resolução alvo do logo no tamanho impresso (0 = manter original)
     # Proteção com senha
     protection_password: str | None = None  # Senha para proteção (edição)
     restrict_editing: bool = False  # Restringir edição do documento
     allow_copy: bool = True  # Permitir copiar texto
     encrypt_content: bool = False  # Criptografar todo o conteúdo
+    strict_protection: bool = False  # Falhar em vez de salvar sem proteção
+    input_password: str | None = None  # Senha para abrir uma entrada encriptada (usuário ou proprietário)
+    open_password: str | None = None  # Nova senha para abrir, com proteção (None = manter a da entrada; "" = nenhuma)
     # Controle de carimbo
     stamp_city: bool = True
     stamp_date: bool = True
+    # Página já carimbada: "stamp" (carimbar de novo), "skip" (ignorar) ou "replace" (substituir)
+    if_stamped: str = "stamp"
+    # Conferência: miniatura PNG só da região do carimbo/logo (lado maior em pixels; 0 = sem miniatura)
+    thumbnail_px: int = 0
+    # Modo compacto: carimbo em um só fluxo q/Q, reaproveitando fontes/imagens iguais já na página
+    compact: bool = False
+    consolidate_stamps: bool = False  # no modo compacto, juntar carimbos compactos anteriores no novo fluxo
+
+
+class ProtectionError(RuntimeError):
+    """Falha ao aplicar a proteção solicitada."""
+
+
+class EncryptedInputError(RuntimeError):
+    """Entrada encriptada sem senha conhecida ou com senha incorreta."""
+
+
+@dataclass
+class StampResult:
+    status: str  # "stamped" | "skipped"
+    page: int
+    text_rect: tuple[float, float, float, float] | None = None
+    logo_rect: tuple[float, float, float, float] | None = None
+    font: str | None = None
+    # Duração de cada fase em segundos (open, text, logo, save)
+    timings: dict[str, float] = field(default_factory=dict)
+    # Degradações ocorridas: font_fallback, logo_failure, protection_fallback, previous_stamp_kept,
+    # text_outside_page, logo_outside_page
+    events: list[str] = field(default_factory=list)
+    thumbnail: bytes | None = None  # PNG da região carimbada (options.thumbnail_px)
+
+
+@dataclass
+class StampMarker:
+    source: str  # "marker" (chave privada) | "text" (busca no retângulo do carimbo)
+    lines: list[str]
+    text_rect: tuple[float, float, float, float] | None = None
+    logo_rect: tuple[float, float, float, float] | None = None
+    logo_xref: int = 0
+    logo_kind: str = "image"  # "image" (imagem) | "form" (logo vetorial PDF/SVG)
+    content_xref: int = 0  # fluxo único do modo compacto (0 = carimbo comum)
+    stream_xrefs: tuple[int, ...] = ()  # fluxos do carimbo comum (texto e logo)
+    source_image: str | None = None  # nome da imagem digitalizada que gerou o PDF
 
 
 def _month_name_pt(month: int) -> str:
@@ -95,227 +176,1245 @@ def _resolve_pdf_font_name(base: str, bold: bool, italic: bool) -> str:
     return base_normalized
 
 
+def _resolve_font_file(options: StampOptions) -> Path | None:
+    # font_file explícito ou "font" apontando para um arquivo TTF/OTF
+    if options.font_file:
+        return Path(options.font_file)
+    raw = (options.font or "").strip()
+    if raw.lower().endswith(_FONT_SUFFIXES) and Path(raw).is_file():
+        return Path(raw)
+    return None
 
-def stamp_pdf(
+
+def _get_font(fontname: str | None = None, fontfile: Path | None = None) -> fitz.Font:
+    """Retorna a fonte analisada do cache do processo (carrega na primeira vez)."""
+    if fontfile is not None:
+        st = fontfile.stat()
+        key: tuple = ("file", str(fontfile.resolve()), st.st_mtime_ns, st.st_size)
+    else:
+        key = ("base14", fontname)
+    font = _FONT_CACHE.get(key)
+    if font is None:
+        with _FONT_CACHE_LOCK:
+            font = _FONT_CACHE.get(key)
+            if font is None:
+                if fontfile is not None:
+                    font = fitz.Font(fontfile=str(fontfile))
+                else:
+                    font = fitz.Font(fontname=fontname)
+                _FONT_CACHE[key] = font
+    return font
+
+
+def _layout_lines(
+    linhas_ativas: list[tuple[str, str]],
+    options: StampOptions,
+    height: float,
+    leading: float,
+) -> list[tuple[str, float, float]]:
+    # Sistema de coordenadas simples:
+    # - Origem (0,0) no canto superior esquerdo.
+    # - X cresce para a direita; Y cresce para baixo.
+    # - X é a posição absoluta do início do texto (alinhado à esquerda).
+
+    # Padrão: posições fixas em pt se x/y não forem informados.
+    if options.x is None and options.y is None:
+        default_coords = {
+            "city": (337.0, 280.0),
+            "date": (391.0, 307.0),
+        }
+        lines_to_draw: list[tuple[str, float, float]] = []
+        for kind, text in linhas_ativas:
+            x_def, y_def = default_coords.get(kind, (337.0, 280.0))
+            lines_to_draw.append((text, x_def, y_def))
+        return lines_to_draw
+
+    x_base = options.x if options.x is not None else options.margin
+    y_base = options.y if options.y is not None else (height - options.margin)
+    temp: list[tuple[str, float, float]] = []
+    y_cursor = y_base
+    for kind, text in reversed(linhas_ativas):
+        temp.append((text, x_base, y_cursor))
+        y_cursor -= leading
+    return list(reversed(temp))
+
+
+def _text_rect(lines_to_draw: list[tuple[str, float, float, float]], fontsize: float) -> fitz.Rect:
+    """Retângulo aproximado ocupado pelas linhas (texto, x, y da linha de base, largura)."""
+    rect = fitz.Rect()
+    for _text, x_pos, y_pos, w in lines_to_draw:
+        rect |= fitz.Rect(x_pos, y_pos - fontsize, x_pos + w, y_pos + fontsize * 0.3)
+    return rect
+
+
+def _rect_tuple(rect: fitz.Rect | None) -> tuple[float, float, float, float] | None:
+    if rect is None or rect.is_empty:
+        return None
+    return (round(rect.x0, 2), round(rect.y0, 2), round(rect.x1, 2), round(rect.y1, 2))
+
+
+@dataclass
+class _PreparedText:
+    font_obj: fitz.Font
+    fontname: str
+    font_file: Path | None
+    lines: list[tuple[str, float, float]]
+    text_rect: tuple[float, float, float, float] | None
+
+
+def _prepare_text(
+    linhas_ativas: list[tuple[str, str]],
+    options: StampOptions,
+    height: float,
+    events: list[str],
+) -> _PreparedText:
+    """Resolve a fonte (com fallback para Helvetica), mede o texto e posiciona as linhas."""
+    font_file = _resolve_font_file(options)
+    fontname = _resolve_pdf_font_name(options.font or "helv", options.bold, options.italic)
+    fontsize = options.font_size
+    # Fonte analisada (cache do processo), com fallback para Helvetica
+    font_obj: fitz.Font | None = None
+    if font_file is not None:
+        try:
+            font_obj = _get_font(fontfile=font_file)
+            fontname = font_obj.name
+        except Exception as e:
+            print(f"[data-hora-pdf] Aviso: Não foi possível carregar a fonte {font_file}: {e}")
+            font_file = None
+            events.append("font_fallback")
+    if font_obj is None:
+        try:
+            font_obj = _get_font(fontname=fontname)
+        except Exception:
+            fontname = _resolve_pdf_font_name("helv", options.bold, options.italic)
+            font_obj = _get_font(fontname=fontname)
+            events.append("font_fallback")
+    leading = fontsize * 1.2  # espaçamento entre linhas (aprox.)
+
+    lines_to_draw = _layout_lines(linhas_ativas, options, height, leading)
+    text_rect = _text_rect(
+        [(t, x, y, font_obj.text_length(t, fontsize=fontsize)) for t, x, y in lines_to_draw],
+        fontsize,
+    )
+    return _PreparedText(font_obj, fontname, font_file, lines_to_draw, _rect_tuple(text_rect))
+
+
+def _stamp_lines(cidade: str, d: date, options: StampOptions) -> list[tuple[str, str]]:
+    # Duas linhas: 1) cidade  2) data por extenso
+    linhas_ativas: list[tuple[str, str]] = []
+    if options.stamp_city:
+        linhas_ativas.append(("city", f"{cidade}".upper()))
+    if options.stamp_date:
+        linhas_ativas.append(("date", f"{data_por_extenso(d)}.".upper()))
+    return linhas_ativas
+
+
+def _resolve_logo_path(options: StampOptions, input_pdf: str | None) -> Path | None:
+    # prioridade: options.logo_path > arquivo padrão no CWD > diretório do PDF de entrada
+    if not options.use_logo:
+        return None
+    candidates: list[Path] = []
+    if options.logo_path:
+        candidates.append(Path(options.logo_path))
+    # nomes comuns
+    for name in ("Logo.jpg", "logo.jpg", "Logo.png", "logo.png"):
+        candidates.append(Path.cwd() / name)
+    if input_pdf:
+        for name in ("Logo.jpg", "logo.jpg", "Logo.png", "logo.png"):
+            candidates.append(Path(input_pdf).resolve().parent / name)
+    for p in candidates:
+        try:
+            if p.exists():
+                return p
+        except Exception:
+            continue
+    return None
+
+
+def _logo_rect(options: StampOptions, height: float, w_img: float, h_img: float) -> fitz.Rect:
+    w_pt = options.logo_width_cm * 28.3465  # 1cm = 28.3465pt
+    h_pt = w_pt * (h_img / w_img)
+    left = options.logo_margin_cm * 28.3465
+    bottom = height - options.logo_margin_cm * 28.3465
+    return fitz.Rect(left, bottom - h_pt, left + w_pt, bottom)
+
+
+@dataclass
+class _PreparedLogo:
+    kind: str  # "image" (JPEG/PNG) | "pdf" (vetorial, uma página)
+    data: bytes
+    width: float  # proporção do logo (px ou pt)
+    height: float
+    flate: bytes | None = None  # amostras RGB já comprimidas (Flate), para logos PNG
+
+
+def _encode_logo_image(path: Path, width_cm: float, dpi: float) -> _PreparedLogo:
+    from PIL import Image  # type: ignore
+
+    with Image.open(path) as im:
+        im = im.convert("RGB")
+        # Reamostrar para o tamanho impresso: mais pixels que isso não aparecem
+        if dpi > 0:
+            target_w = max(1, round(width_cm / 2.54 * dpi))
+            if im.width > target_w:
+                target_h = max(1, round(im.height * target_w / im.width))
+                im = im.resize((target_w, target_h), Image.LANCZOS)
+        w_img, h_img = im.size
+        bio = io.BytesIO()
+        flate = None
+        # Poucas cores (arte chapada) -> PNG sem perdas; foto/degradê -> JPEG.
+        # Sem perfil ICC em ambos, para evitar mensagens do MuPDF.
+        if im.getcolors(maxcolors=256) is not None:
+            im.save(bio, format="PNG", optimize=True, icc_profile=None)
+            # O MuPDF grava o PNG como amostras sem compressão: comprimidas aqui uma vez por logo
+            flate = zlib.compress(im.tobytes(), 9)
+        else:
+            im.save(bio, format="JPEG", quality=90, optimize=True, icc_profile=None)
+    return _PreparedLogo("image", bio.getvalue(), w_img, h_img, flate)
+
+
+def _convert_vector_logo(path: Path) -> _PreparedLogo:
+    src = fitz.open(str(path))
+    try:
+        if path.suffix.lower() == ".pdf":
+            rect = src[0].rect
+            one = fitz.open()
+            one.insert_pdf(src, from_page=0, to_page=0)
+            data = one.tobytes(garbage=3, deflate=True)
+            one.close()
+        else:
+            # SVG: MuPDF converte para uma página PDF vetorial
+            rect = src[0].rect
+            data = src.convert_to_pdf()
+    finally:
+        src.close()
+    return _PreparedLogo("pdf", data, rect.width, rect.height)
+
+
+def _prepare_logo(path: Path, options: StampOptions) -> _PreparedLogo:
+    """Logo pronto para inserir, preparado uma única vez por processo."""
+    st = path.stat()
+    vector = path.suffix.lower() in _VECTOR_LOGO_SUFFIXES
+    key = (str(path.resolve()), st.st_mtime_ns, st.st_size) + (() if vector else (options.logo_width_cm, options.logo_dpi))
+    logo = _LOGO_CACHE.get(key)
+    if logo is None:
+        with _LOGO_CACHE_LOCK:
+            logo = _LOGO_CACHE.get(key)
+            if logo is None:
+                if vector:
+                    logo = _convert_vector_logo(path)
+                else:
+                    logo = _encode_logo_image(path, options.logo_width_cm, options.logo_dpi)
+                _LOGO_CACHE[key] = logo
+    return logo
+
+
+def _logo_size(path: Path) -> tuple[float, float]:
+    # Só as dimensões: cabeçalho da imagem ou tamanho da página do logo vetorial
+    if path.suffix.lower() in _VECTOR_LOGO_SUFFIXES:
+        src = fitz.open(str(path))
+        try:
+            return src[0].rect.width, src[0].rect.height
+        finally:
+            src.close()
+    from PIL import Image  # type: ignore
+
+    with Image.open(path) as im:
+        return im.size
+
+
+def _insert_logo(page: fitz.Page, rect: fitz.Rect, logo: _PreparedLogo) -> tuple[int, str]:
+    """Insere o logo e devolve (xref, tipo) para o marcador do carimbo."""
+    if logo.kind == "pdf":
+        src = fitz.open("pdf", logo.data)
+        try:
+            return page.show_pdf_page(rect, src, 0, keep_proportion=True), "form"
+        finally:
+            src.close()
+    xref = page.insert_image(rect, stream=logo.data, keep_proportion=True)
+    doc = page.parent
+    raw_size = int(logo.width) * int(logo.height) * 3
+    if (
+        logo.flate is not None
+        and doc.xref_get_key(xref, "Filter")[0] == "null"
+        and doc.xref_get_key(xref, "Length")[1] == str(raw_size)
+    ):
+        # Troca as amostras cruas pelas já comprimidas (mesmos pixels, RGB 8 bits)
+        doc.update_stream(xref, logo.flate, compress=False)
+        doc.xref_set_key(xref, "Filter", "/FlateDecode")
+    return xref, "image"
+
+
+@dataclass
+class StampLayout:
+    lines: list[tuple[str, float, float]]  # (texto, x, y da linha de base)
+    text_rect: tuple[float, float, float, float] | None
+    logo_rect: tuple[float, float, float, float] | None
+    logo_path: str | None
+    font: str
+    events: list[str] = field(default_factory=list)
+
+
+def compute_layout(
+    page_width: float,
+    page_height: float,
+    cidade: str,
+    d: date | None = None,
+    options: StampOptions | None = None,
+    input_pdf: str | None = None,
+) -> StampLayout:
+    """Calcula onde o carimbo e o logo ficariam, sem abrir nem alterar o PDF.
+
+    Usa a mesma resolução de fonte, medição de texto e busca de logo de
+    stamp_pdf; do logo lê apenas as dimensões (cabeçalho da imagem ou
+    página do logo vetorial).
+    """
+    if options is None:
+        options = StampOptions()
+    if d is None:
+        d = date.today()
+    events: list[str] = []
+    text = _prepare_text(_stamp_lines(cidade, d, options), options, page_height, events)
+    logo_file = _resolve_logo_path(options, input_pdf)
+    logo_rect = None
+    if logo_file is not None:
+        try:
+            w_img, h_img = _logo_size(logo_file)
+            logo_rect = _rect_tuple(_logo_rect(options, page_height, w_img, h_img))
+        except Exception:
+            events.append("logo_failure")
+    return StampLayout(
+        lines=text.lines,
+        text_rect=text.text_rect,
+        logo_rect=logo_rect,
+        logo_path=str(logo_file) if logo_file is not None else None,
+        font=text.fontname,
+        events=events,
+    )
+
+
+@dataclass
+class StampPlan:
+    status: str  # "ok" | "warning" | "error"
+    problems: list[str] = field(default_factory=list)
+    page: int = 0
+    page_count: int = 0
+    page_size: tuple[float, float] | None = None
+    layout: StampLayout | None = None
+    already_stamped: str | None = None  # origem do carimbo existente ("marker" | "text")
+
+
+# Problemas que impedem o carimbo; os demais só degradam o resultado
+_PLAN_ERRORS = {
+    "missing_input",
+    "encrypted_input",
+    "missing_page",
+    "future_date",
+    "invalid_color",
+    "invalid_font_size",
+    "invalid_if_stamped",
+}
+
+
+def _option_problems(options: StampOptions) -> list[str]:
+    """Opções que fariam stamp_pdf falhar, conferidas com os mesmos parsers."""
+    problems: list[str] = []
+    try:
+        _parse_hex_color(options.color)
+    except (ValueError, AttributeError):
+        problems.append("invalid_color")
+    if not options.font_size or options.font_size <= 0:
+        problems.append("invalid_font_size")
+    if options.if_stamped not in ("stamp", "skip", "replace"):
+        problems.append("invalid_if_stamped")
+    return problems
+
+
+def plan_stamp(
     input_pdf: str,
-    output_pdf: str,
     cidade: str,
     d: date | None = None,
     options: StampOptions | None = None,
-) -> None:
-    """Carimba o PDF com "Cidade, dia de mês de ano".
+) -> StampPlan:
+    """Valida um carimbo e calcula o layout final sem desenhar nem salvar.
 
-    - input_pdf: caminho do PDF de entrada
-    - output_pdf: caminho do PDF de saída
-    - cidade: nome da cidade
-    - d: data (padrão = hoje)
-    - options: configurações de página/posição/estilo
+    Abre o PDF apenas para ler o tamanho real da página e o marcador de
+    carimbo anterior; fonte, texto e logo passam pelas mesmas funções de
+    stamp_pdf (via compute_layout).
     """
     if options is None:
         options = StampOptions()
     if d is None:
         d = date.today()
+    plan = StampPlan(status="ok", page=options.page)
+    if d > date.today():
+        plan.problems.append("future_date")
+    plan.problems.extend(_option_problems(options))
+    if not Path(input_pdf).is_file():
+        plan.problems.append("missing_input")
+    else:
+        doc = fitz.open(input_pdf)
+        try:
+            # Mesma verificação de stamp_pdf: senha conhecida e correta antes de tudo
+            unlocked = not doc.needs_pass or bool(options.input_password and doc.authenticate(options.input_password))
+            plan.page_count = len(doc)
+            if not unlocked:
+                plan.problems.append("encrypted_input")
+            elif options.page < 0 or options.page >= len(doc):
+                plan.problems.append("missing_page")
+            else:
+                page_rect = doc[options.page].rect
+                plan.page_size = (round(page_rect.width, 2), round(page_rect.height, 2))
+                layout = compute_layout(page_rect.width, page_rect.height, cidade, d, options, input_pdf)
+                plan.layout = layout
+                plan.problems.extend(layout.events)
+                if options.logo_path and layout.logo_path is not None and Path(layout.logo_path) != Path(options.logo_path):
+                    # Logo informado não existe: stamp_pdf usaria o Logo.jpg padrão
+                    plan.problems.append("missing_logo")
+                elif options.logo_path and layout.logo_path is None:
+                    plan.problems.append("missing_logo")
+                if layout.text_rect and not page_rect.contains(fitz.Rect(layout.text_rect)):
+                    plan.problems.append("text_outside_page")
+                if layout.logo_rect and not page_rect.contains(fitz.Rect(layout.logo_rect)):
+                    plan.problems.append("logo_outside_page")
+                # Imagem digitalizada ainda não tem carimbo (nem marcador)
+                previous = None if is_image_input(input_pdf) else _find_stamp(doc, options)
+                if previous is not None:
+                    plan.already_stamped = previous.source
+                    if options.if_stamped == "stamp":
+                        plan.problems.append("already_stamped")
+        finally:
+            doc.close()
+    if any(problem in _PLAN_ERRORS for problem in plan.problems):
+        plan.status = "error"
+    elif plan.problems:
+        plan.status = "warning"
+    return plan
 
-    # Duas linhas: 1) cidade  2) data por extenso
-    linha1 = f"{cidade}".upper()
-    linha2 = f"{data_por_extenso(d)}.".upper()
-    linhas_ativas: list[tuple[str, str]] = []
-    if options.stamp_city:
-        linhas_ativas.append(("city", linha1))
-    if options.stamp_date:
-        linhas_ativas.append(("date", linha2))
 
-    doc = fitz.open(input_pdf)
-    replace_plan: tuple[Path, Path] | None = None
+def _read_marker(doc: fitz.Document, pno: int) -> StampMarker | None:
+    # Leitura direta do dicionário da página: não carrega conteúdo nem fontes
+    kind, value = doc.xref_get_key(doc.page_xref(pno), _MARKER_KEY)
+    if kind != "string":
+        return None
     try:
-        if options.page < 0 or options.page >= len(doc):
-            raise IndexError(f"Página {options.page} não existe no PDF (total {len(doc)}).")
-        page = doc[options.page]
+        data = json.loads(value)
+    except ValueError:
+        return None
+    text_rect = data.get("text_rect")
+    logo_rect = data.get("logo_rect")
+    return StampMarker(
+        source="marker",
+        lines=list(data.get("lines", [])),
+        text_rect=tuple(text_rect) if text_rect else None,
+        logo_rect=tuple(logo_rect) if logo_rect else None,
+        logo_xref=int(data.get("logo_xref", 0) or 0),
+        logo_kind=data.get("logo_kind", "image"),
+        content_xref=int(data.get("content_xref", 0) or 0),
+        stream_xrefs=tuple(int(x) for x in data.get("stream_xrefs", [])),
+        source_image=data.get("source_image"),
+    )
 
-        # Definir posição padrão/atributos
-        fontname = _resolve_pdf_font_name(options.font or "helv", options.bold, options.italic)
-        used_font = fontname
-        fontsize = options.font_size
-        color = _parse_hex_color(options.color)
 
-        width, height = page.rect.width, page.rect.height
-    # Cálculo de largura com fallback de fonte (usado só para leading)
+def _write_marker(
+    doc: fitz.Document,
+    page: fitz.Page,
+    result: StampResult,
+    lines: list[str],
+    logo_xref: int,
+    logo_kind: str = "image",
+    content_xref: int = 0,
+    stream_xrefs: list[int] | None = None,
+    source_image: str | None = None,
+) -> None:
+    data = {
+        "v": 1,
+        "lines": lines,
+        "text_rect": result.text_rect,
+        "logo_rect": result.logo_rect,
+        "logo_xref": logo_xref,
+        "logo_kind": logo_kind,
+    }
+    if content_xref:
+        data["content_xref"] = content_xref
+    if stream_xrefs:
+        data["stream_xrefs"] = stream_xrefs
+    if source_image:
+        data["source_image"] = source_image
+    doc.xref_set_key(page.xref, _MARKER_KEY, fitz.get_pdf_str(json.dumps(data)))
+
+
+def _search_stamp_text(page: fitz.Page, options: StampOptions) -> StampMarker | None:
+    """Busca limitada ao retângulo do carimbo para PDFs carimbados sem marcador.
+
+    Só aceita linhas que começam exatamente onde o carimbo as desenharia:
+    a linha de data inteira no formato de data_por_extenso e, logo acima,
+    a da cidade. Texto do próprio documento na região não conta.
+    """
+    leading = options.font_size * 1.2
+    kinds = [("city", "X"), ("date", "X")]
+    probe = {kind: (x, y) for (kind, _), (_t, x, y) in zip(kinds, _layout_lines(kinds, options, page.rect.height, leading))}
+    tolerance = options.font_size * 0.5
+    xs = [x for x, _y in probe.values()]
+    ys = [y for _x, y in probe.values()]
+    # Largura folgada para "30 DE SETEMBRO DE 2024." em qualquer fonte
+    region = fitz.Rect(
+        min(xs) - tolerance,
+        min(ys) - options.font_size * 2.5,
+        max(xs) + options.font_size * 18,
+        max(ys) + options.font_size * 1.5,
+    ) & page.rect
+    if region.is_empty:
+        return None
+
+    found: list[tuple[str, fitz.Rect]] = []
+    for block in page.get_text("dict", clip=region).get("blocks", []):
+        for line in block.get("lines", []):
+            text = "".join(span.get("text", "") for span in line.get("spans", [])).strip()
+            if text:
+                found.append((text, fitz.Rect(line["bbox"])))
+
+    def starts_at(bbox: fitz.Rect, kind: str) -> bool:
+        x, y = probe[kind]
+        return abs(bbox.x0 - x) <= tolerance and bbox.y0 - tolerance <= y <= bbox.y1 + tolerance
+
+    dates = [(text, bbox) for text, bbox in found if _DATE_LINE_RE.fullmatch(text) and starts_at(bbox, "date")]
+    if not dates:
+        return None
+    date_text, date_bbox = dates[-1]
+    lines = [date_text]
+    rect = fitz.Rect(date_bbox)
+    # Linha da cidade: imediatamente acima da linha de data, no x do carimbo
+    for text, bbox in found:
+        if starts_at(bbox, "city") and bbox.y1 <= date_bbox.y0 + 1 and date_bbox.y0 - bbox.y1 <= options.font_size * 2:
+            lines.insert(0, text)
+            rect |= bbox
+            break
+    return StampMarker(source="text", lines=lines, text_rect=_rect_tuple(rect))
+
+
+def _find_stamp(doc: fitz.Document, options: StampOptions) -> StampMarker | None:
+    marker = _read_marker(doc, options.page)
+    if marker is not None:
+        return marker
+    return _search_stamp_text(doc[options.page], options)
+
+
+def _page_resources(page: fitz.Page) -> dict[str, int]:
+    """Fontes e XObjects do dicionário de recursos da própria página: nome -> xref."""
+    found = {f[4]: f[0] for f in page.get_fonts(full=True) if f[-1] == 0}
+    found.update({img[7]: img[0] for img in page.get_images(full=True) if img[-1] == 0})
+    found.update({x[1]: x[0] for x in page.get_xobjects() if x[2] == 0})
+    return found
+
+
+def _resource_signature(doc: fitz.Document, xref: int) -> tuple:
+    # Comparação barata antes do hash: evita decodificar imagens grandes (página digitalizada)
+    return tuple(doc.xref_get_key(xref, key)[1] for key in ("Subtype", "Width", "Height", "BaseFont", "BBox"))
+
+
+def _object_digest(doc: fitz.Document, xref: int, memo: dict[int, str]) -> str:
+    """Hash do objeto e de tudo que ele referencia (independe dos números de xref).
+
+    Usa o fluxo decodificado: em PDFs encriptados o fluxo gravado muda a
+    cada objeto, mesmo com conteúdo igual. /Length e /Filter ficam de fora
+    pelo mesmo motivo.
+    """
+    if xref in memo:
+        return memo[xref]
+    memo[xref] = "ciclo"
+    text = _OBJ_REF_RE.sub(lambda m: _object_digest(doc, int(m.group(1)), memo), doc.xref_object(xref, compressed=True))
+    text = _STREAM_KEYS_RE.sub("", text)
+    digest = hashlib.sha256(text.encode("utf-8", "surrogateescape"))
+    if doc.xref_is_stream(xref):
+        digest.update(doc.xref_stream(xref) or b"")
+    memo[xref] = digest.hexdigest()
+    return memo[xref]
+
+
+def _drop_resources(page: fitz.Page, names: set[str]) -> None:
+    """Remove entradas do dicionário de recursos da página (Font e XObject)."""
+    if not names:
+        return
+    doc = page.parent
+    pattern = re.compile(r"/(?:%s)\s+\d+\s+0\s+R" % "|".join(re.escape(n) for n in names))
+    # xref_set_key com caminho ("Resources/XObject/...") não atravessa objetos indiretos
+    # de forma confiável: reescrever cada dicionário no objeto que o contém
+    kind, value = doc.xref_get_key(page.xref, "Resources")
+    if kind == "xref":
+        res_xref = int(value.split()[0])
+        doc.update_object(res_xref, pattern.sub("", doc.xref_object(res_xref, compressed=True)))
+    elif kind == "dict":
+        doc.xref_set_key(page.xref, "Resources", pattern.sub("", value))
+    for sub in ("Font", "XObject"):
+        kind, value = doc.xref_get_key(page.xref, f"Resources/{sub}")
+        if kind == "xref":
+            sub_xref = int(value.split()[0])
+            doc.update_object(sub_xref, pattern.sub("", doc.xref_object(sub_xref, compressed=True)))
+
+
+def _set_contents(page: fitz.Page, xrefs: list[int]) -> None:
+    page.parent.xref_set_key(page.xref, "Contents", "[%s]" % " ".join(f"{x} 0 R" for x in xrefs))
+
+
+def _compact_stamp(
+    page: fitz.Page,
+    contents_before: list[int],
+    resources_before: dict[str, int],
+    consolidate: bool,
+) -> tuple[int, dict[int, int]]:
+    """Junta os fluxos recém-desenhados do carimbo em um só, envolto em q/Q.
+
+    Fontes e imagens novas idênticas (por hash) a recursos que a página já
+    tinha passam a usar o recurso existente; as cópias ficam sem referência
+    e saem na gravação (garbage). Com consolidate, fluxos compactos de
+    carimbos anteriores entram no mesmo fluxo. Devolve (xref do fluxo,
+    {xref novo: xref reaproveitado}).
+    """
+    doc = page.parent
+    contents = page.get_contents()
+    new_streams = [x for x in contents if x not in contents_before]
+    if not new_streams:
+        return 0, {}
+    body = b"\n".join(doc.xref_stream(x) or b"" for x in new_streams)
+
+    reused: dict[int, int] = {}
+    memo: dict[int, str] = {}
+    signatures = {name: _resource_signature(doc, xref) for name, xref in resources_before.items()}
+    dropped: set[str] = set()
+    for name, xref in _page_resources(page).items():
+        if name in resources_before or xref in resources_before.values():
+            continue
+        signature = _resource_signature(doc, xref)
+        digest = None
+        match = None
+        for old_name, old_xref in resources_before.items():
+            if signatures[old_name] != signature:
+                continue
+            digest = digest or _object_digest(doc, xref, memo)
+            if _object_digest(doc, old_xref, memo) == digest:
+                match = old_name, old_xref
+                break
+        if match is None:
+            continue
+        old_name, old_xref = match
+        body = re.sub(rb"/" + re.escape(name.encode()) + rb"(?=[\s/\[<(])", b"/" + old_name.encode(), body)
+        dropped.add(name)
+        reused[xref] = old_xref
+    _drop_resources(page, dropped)
+
+    keep = [x for x in contents if x not in new_streams]
+    if consolidate:
+        previous = [x for x in keep if (doc.xref_stream(x) or b"").lstrip().startswith(_COMPACT_PREFIX)]
+        body = b"\n".join([*(doc.xref_stream(x) or b"" for x in previous), body])
+        keep = [x for x in keep if x not in previous]
+    target = new_streams[0]
+    doc.update_stream(target, _COMPACT_PREFIX + b"\n" + body + b"\nQ\n")
+    _set_contents(page, keep + [target])
+    return target, reused
+
+
+def _remove_streams(page: fitz.Page, targets: list[int]) -> None:
+    """Tira os fluxos da página e os recursos que só eles usavam (sem redação).
+
+    Os objetos ficam sem referência e saem na gravação (garbage).
+    """
+    doc = page.parent
+    removed = b"\n".join(doc.xref_stream(x) or b"" for x in targets)
+    remaining = [x for x in page.get_contents() if x not in targets]
+    _set_contents(page, remaining)
+    used_elsewhere = b"\n".join(doc.xref_stream(x) or b"" for x in remaining)
+    names = {m.decode("latin-1") for m in _RESOURCE_USE_RE.findall(removed)}
+    _drop_resources(page, {n for n in names if b"/" + n.encode("latin-1") not in used_elsewhere})
+
+
+def _remove_compact_stamp(page: fitz.Page, marker: StampMarker) -> bool:
+    """Tira da página o fluxo único do carimbo compacto. False se não achar."""
+    doc = page.parent
+    tagged = [x for x in page.get_contents() if (doc.xref_stream(x) or b"").lstrip().startswith(_COMPACT_PREFIX)]
+    if not tagged:
+        return False
+    # xref do marcador, ou o último fluxo compacto se o arquivo foi renumerado por outra ferramenta
+    _remove_streams(page, [marker.content_xref if marker.content_xref in tagged else tagged[-1]])
+    return True
+
+
+def _legacy_stamp_streams(page: fitz.Page, marker: StampMarker) -> list[int]:
+    """Fluxos de um carimbo gravado sem a lista de fluxos (versões antigas).
+
+    Entram fluxos de texto puro em que cada bloco BT/ET é exatamente uma das
+    linhas do carimbo e, se o marcador tiver o logo, o fluxo que só o desenha.
+    """
+    doc = page.parent
+    logo_names = [name for name, xref in _page_resources(page).items() if marker.logo_xref and xref == marker.logo_xref]
+    found: list[int] = []
+    for xref in page.get_contents():
+        stream = doc.xref_stream(xref) or b""
+        if b"BT" not in stream:
+            if any(re.search(rb"/" + re.escape(n.encode("latin-1")) + rb"\s+Do\b", stream) for n in logo_names):
+                if len(re.findall(rb"\bDo\b", stream)) == 1:
+                    found.append(xref)
+            continue
+        if b" Do" in stream:
+            continue
         try:
-            w1 = fitz.get_text_length(linha1, fontname=fontname, fontsize=fontsize)
-            w2 = fitz.get_text_length(linha2, fontname=fontname, fontsize=fontsize)
-        except Exception:
-            fontname = _resolve_pdf_font_name("helv", options.bold, options.italic)
-            used_font = fontname
-            w1 = fitz.get_text_length(linha1, fontname=fontname, fontsize=fontsize)
-            w2 = fitz.get_text_length(linha2, fontname=fontname, fontsize=fontsize)
-        leading = fontsize * 1.2  # espaçamento entre linhas (aprox.)
+            blocks = [
+                "".join(bytes.fromhex(h.decode()).decode("cp1252") for h in re.findall(rb"<([0-9a-fA-F]+)>", block))
+                for block in re.findall(rb"BT\b(.*?)\bET", stream, re.S)
+            ]
+        except ValueError:
+            continue
+        if blocks and all(text in marker.lines for text in blocks):
+            found.append(xref)
+    return found
 
-    # Sistema de coordenadas simples:
-    # - Origem (0,0) no canto superior esquerdo.
-    # - X cresce para a direita; Y cresce para baixo.
-    # - X é a posição absoluta do início do texto (alinhado à esquerda).
 
-        # Padrão: posições fixas em pt se x/y não forem informados.
-        lines_to_draw: list[tuple[str, float, float]] = []
-        if options.x is None and options.y is None:
-            default_coords = {
-                "city": (337.0, 280.0),
-                "date": (391.0, 307.0),
-            }
-            for kind, text in linhas_ativas:
-                x_def, y_def = default_coords.get(kind, (337.0, 280.0))
-                lines_to_draw.append((text, x_def, y_def))
-        else:
-            x_base = options.x if options.x is not None else options.margin
-            y_base = options.y if options.y is not None else (height - options.margin)
-            temp: list[tuple[str, float, float]] = []
-            y_cursor = y_base
-            for kind, text in reversed(linhas_ativas):
-                temp.append((text, x_base, y_cursor))
-                y_cursor -= leading
-            lines_to_draw = list(reversed(temp))
-
-        used_font = fontname
-        if not lines_to_draw:
-            try:
-                print("[data-hora-pdf] Aviso: Nenhum texto carimbado (cidade/data desativadas).")
-            except Exception:
-                pass
-        else:
-            current_font = fontname
-            for text, x_pos, y_pos in lines_to_draw:
-                try:
-                    page.insert_text((x_pos, y_pos), text, fontsize=fontsize, fontname=current_font, fill=color, render_mode=0)
-                except Exception:
-                    current_font = _resolve_pdf_font_name("helv", options.bold, options.italic)
-                    used_font = current_font
-                    page.insert_text((x_pos, y_pos), text, fontsize=fontsize, fontname=current_font, fill=color, render_mode=0)
-            # Log simples para depuração
+def _remove_stamp(page: fitz.Page, marker: StampMarker) -> bool:
+    """Remove o carimbo anterior descrito pelo marcador. False se não o achar na página."""
+    if marker.content_xref:
+        return _remove_compact_stamp(page, marker)
+    doc = page.parent
+    contents = page.get_contents()
+    tagged = [x for x in contents if (doc.xref_stream(x) or b"").lstrip().startswith(_STAMP_TAG)]
+    targets = [x for x in marker.stream_xrefs if x in tagged] or tagged
+    if not targets:
+        targets = _legacy_stamp_streams(page, marker)
+    if not targets:
+        return False
+    _remove_streams(page, targets)
+    return True
+
+
+def _render_stamp_region(page: fitz.Page, result: StampResult, max_px: int) -> bytes | None:
+    """Renderiza apenas os retângulos do carimbo e do logo (com folga) em PNG.
+
+    Quando texto e logo ficam distantes (cantos opostos), cada região é
+    renderizada separadamente e as duas são postas lado a lado, para que o
+    texto não vire um ponto no meio de uma página inteira. Retângulos que
+    saem da página são recortados nela; None se nada ficou na página.
+    """
+    clips = [fitz.Rect(r) & page.rect for r in (result.text_rect, result.logo_rect) if r is not None]
+    clips = [(c + (-6, -6, 6, 6)) & page.rect for c in clips if not c.is_empty]
+    if not clips:
+        return None
+    union = fitz.Rect(clips[0])
+    for clip in clips[1:]:
+        union |= clip
+    if union.width * union.height <= 2 * sum(c.width * c.height for c in clips):
+        clips = [union]
+    zoom = min(4.0, max_px / max(sum(c.width for c in clips), max(c.height for c in clips)))
+    parts = [page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=c, alpha=False) for c in clips]
+    if len(parts) == 1:
+        return parts[0].tobytes("png")
+    canvas = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, sum(p.width for p in parts), max(p.height for p in parts)), False)
+    canvas.clear_with(255)
+    x = 0
+    for part in parts:
+        part.set_origin(x, 0)
+        canvas.copy(part, part.irect)
+        x += part.width
+    return canvas.tobytes("png")
+
+
+def _has_protection(options: StampOptions) -> bool:
+    return bool(
+        options.protection_password
+        or options.open_password
+        or options.restrict_editing
+        or not options.allow_copy
+        or options.encrypt_content
+    )
+
+
+def _open_password(options: StampOptions, locked: bool) -> str:
+    """Senha para abrir a saída protegida.
+
+    Sem open_password, uma entrada que pedia senha para abrir (locked, ver
+    _authenticate) continua pedindo: a senha usada para abri-la é mantida.
+    """
+    if options.open_password is not None:
+        return options.open_password
+    return (options.input_password or "") if locked else ""
+
+
+def _protection_kwargs(options: StampOptions, user_pw: str = "") -> dict:
+    """Parâmetros de encriptação para Document.save a partir das opções.
+
+    user_pw é a senha para abrir (ver _open_password); vazia, o documento abre sem senha.
+    """
+    # Configurar permissões
+    permissions = -1  # Todas as permissões por padrão
+
+    if options.restrict_editing:
+        # Remove permissões de modificação
+        permissions &= ~(fitz.PDF_PERM_MODIFY | fitz.PDF_PERM_ANNOTATE | fitz.PDF_PERM_FORM)
+
+    if not options.allow_copy:
+        # Remove permissões de cópia
+        permissions &= ~(fitz.PDF_PERM_COPY | fitz.PDF_PERM_ACCESSIBILITY)
+
+    # Aplicar encriptação: AES-256 (forte) ou RC4-128 (padrão)
+    encrypt_method = fitz.PDF_ENCRYPT_AES_256 if options.encrypt_content else fitz.PDF_ENCRYPT_RC4_128
+    return {
+        "encryption": encrypt_method,
+        "owner_pw": options.protection_password or "",
+        "user_pw": user_pw,
+        "permissions": permissions,
+    }
+
+
+def _authenticate(doc: fitz.Document, password: str | None, source: str) -> bool:
+    """Desbloqueia uma entrada encriptada logo após abrir (só lê a tabela xref).
+
+    Falha antes de qualquer trabalho de carimbo; o documento é fechado.
+    Devolve True se a entrada pedia senha para abrir. needs_pass não deve
+    ser lido de novo depois de authenticate: no PyMuPDF 1.24 isso desfaz a
+    decodificação e a gravação seguinte sai com os fluxos corrompidos.
+    """
+    if not doc.needs_pass:
+        return False
+    if not password:
+        doc.close()
+        raise EncryptedInputError(f"PDF encriptado e nenhuma senha informada: {source or 'documento'}")
+    if not doc.authenticate(password):
+        doc.close()
+        raise EncryptedInputError(f"Senha incorreta para o PDF encriptado: {source or 'documento'}")
+    return True
+
+
+def _input_encryption(doc: fitz.Document) -> str | None:
+    # Método de encriptação da entrada (inclusive só com senha de proprietário)
+    return (doc.metadata or {}).get("encryption") or None
+
+
+def _open_input(input_pdf: str, password: str | None = None) -> tuple[fitz.Document, bool]:
+    """Abre (e desbloqueia) a entrada; devolve (documento, pedia senha para abrir)."""
+    # Imagens digitalizadas (TIFF/JPEG/PNG) viram PDF em memória, quadro a quadro
+    if is_image_input(input_pdf):
+        return fitz.open("pdf", image_to_pdf_bytes(Path(input_pdf).read_bytes(), input_pdf)), False
+    doc = fitz.open(input_pdf)
+    return doc, _authenticate(doc, password, input_pdf)
+
+
+def _open_bytes(data: bytes, password: str | None, source: str) -> tuple[fitz.Document, bool]:
+    doc = fitz.open("pdf", data)
+    return doc, _authenticate(doc, password, source)
+
+
+def _save_document(doc: fitz.Document, input_pdf: str, output_pdf: str, **save_kwargs) -> tuple[Path, Path] | None:
+    """Salva o documento; se a saída for o próprio arquivo de entrada, grava em tmp
+    e devolve o plano de substituição (aplicado após fechar o documento)."""
+    try:
+        same = Path(input_pdf).resolve() == Path(output_pdf).resolve()
+    except Exception:
+        same = False
+    if not same:
+        doc.save(output_pdf, **save_kwargs)
+        return None
+    target = Path(output_pdf)
+    tmp = target.with_name(f"{target.stem}__tmp__{target.suffix}")
+    try:
+        doc.save(str(tmp), **save_kwargs)
+    except Exception:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+    return (tmp, target)
+
+
+def _apply_replace_plan(replace_plan: tuple[Path, Path] | None) -> None:
+    if replace_plan is None:
+        return
+    tmp, target = replace_plan
+    try:
+        tmp.replace(target)
+    finally:
+        if tmp.exists():
             try:
-                print(f"[data-hora-pdf] Fonte efetiva: {used_font} | bold={options.bold} | italic={options.italic}")
+                tmp.unlink()
             except Exception:
                 pass
 
-        # Inserir logo no canto inferior esquerdo, se disponível
-        def _resolve_logo_path() -> Path | None:
-            # prioridade: options.logo_path > arquivo padrão no CWD > diretório do PDF de entrada
-            candidates: list[Path] = []
-            if options.logo_path:
-                candidates.append(Path(options.logo_path))
-            # nomes comuns
-            for name in ("Logo.jpg", "logo.jpg", "Logo.png", "logo.png"):
-                candidates.append(Path.cwd() / name)
-            for name in ("Logo.jpg", "logo.jpg", "Logo.png", "logo.png"):
-                candidates.append(Path(input_pdf).resolve().parent / name)
-            for p in candidates:
-                try:
-                    if p.exists():
-                        return p
-                except Exception:
-                    continue
-            return None
-
-        logo_file = _resolve_logo_path()
-        if logo_file is not None:
-            # Inserir somente via Pillow para evitar avisos de ICC do MuPDF
+
+def protect_pdf(input_pdf: str, output_pdf: str, options: StampOptions) -> None:
+    """Aplica ou altera a proteção de um PDF existente sem tocar no conteúdo das páginas.
+
+    Usa os campos de proteção de options (protection_password, restrict_editing,
+    allow_copy, encrypt_content). Ao contrário de stamp_pdf, nunca grava o arquivo
+    sem proteção: qualquer falha gera ProtectionError.
+    """
+    if not _has_protection(options):
+        raise ProtectionError("Nenhuma proteção informada (senha, restrições ou criptografia).")
+    doc, locked = _open_input(input_pdf, options.input_password)
+    replace_plan: tuple[Path, Path] | None = None
+    try:
+        try:
+            replace_plan = _save_document(
+                doc, input_pdf, output_pdf, **_protection_kwargs(options, _open_password(options, locked))
+            )
+        except Exception as e:
+            raise ProtectionError(f"Não foi possível aplicar proteção em {input_pdf}: {e}") from e
+    finally:
+        doc.close()
+        _apply_replace_plan(replace_plan)
+
+    # Conferência: o arquivo gravado precisa estar encriptado
+    check = fitz.open(output_pdf)
+    try:
+        # Com senha para abrir, os metadados só são legíveis após autenticar
+        encryption = check.needs_pass or _input_encryption(check)
+    finally:
+        check.close()
+    if not encryption:
+        raise ProtectionError(f"Arquivo gravado sem encriptação: {output_pdf}")
+
+
+def protect_pdf_bytes(data: bytes, options: StampOptions, source: str = "") -> bytes:
+    """Como protect_pdf, mas em memória: recebe e devolve o conteúdo do PDF."""
+    if not _has_protection(options):
+        raise ProtectionError("Nenhuma proteção informada (senha, restrições ou criptografia).")
+    doc, locked = _open_bytes(data, options.input_password, source)
+    try:
+        out = doc.tobytes(**_protection_kwargs(options, _open_password(options, locked)))
+    except Exception as e:
+        raise ProtectionError(f"Não foi possível aplicar proteção em {source or 'documento'}: {e}") from e
+    finally:
+        doc.close()
+
+    check = fitz.open("pdf", out)
+    try:
+        # Com senha para abrir, os metadados só são legíveis após autenticar
+        encryption = check.needs_pass or _input_encryption(check)
+    finally:
+        check.close()
+    if not encryption:
+        raise ProtectionError(f"Documento gerado sem encriptação: {source or 'documento'}")
+    return out
+
+
+def detect_stamp(input_pdf: str, options: StampOptions | None = None) -> StampMarker | None:
+    """Verifica se a página alvo já foi carimbada, sem salvar nada.
+
+    Lê primeiro o marcador privado gravado por stamp_pdf; se não houver,
+    faz uma busca de texto limitada ao retângulo do carimbo.
+    """
+    if options is None:
+        options = StampOptions()
+    doc, _locked = _open_input(input_pdf, options.input_password)
+    try:
+        if options.page < 0 or options.page >= len(doc):
+            raise IndexError(f"Página {options.page} não existe no PDF (total {len(doc)}).")
+        return _find_stamp(doc, options)
+    finally:
+        doc.close()
+
+
+def _save_protected(
+    options: StampOptions,
+    events: list[str],
+    save: Callable[..., _T],
+    keep_encryption: bool = False,
+    user_pw: str = "",
+) -> _T:
+    """Chama save com os parâmetros de proteção das opções.
+
+    Sem proteção nas opções, keep_encryption mantém a encriptação original
+    da entrada (mesmas senhas e permissões); proteção informada a substitui.
+
+    Se a proteção falhar, salva sem ela e registra "protection_fallback"
+    (ou gera ProtectionError com strict_protection). user_pw é a senha para
+    abrir a saída protegida (ver _open_password).
+    """
+    original = {"encryption": fitz.PDF_ENCRYPT_KEEP} if keep_encryption else {}
+    if not _has_protection(options):
+        return save(**original)
+    try:
+        return save(**_protection_kwargs(options, user_pw))
+    except Exception as e:
+        if options.strict_protection:
+            raise ProtectionError(f"Não foi possível aplicar proteção: {e}") from e
+        # Fallback: salvar sem proteção se der erro
+        print(f"[data-hora-pdf] Aviso: Não foi possível aplicar proteção: {e}")
+        events.append("protection_fallback")
+        return save(**original)
+
+
+def _cleanup_save_kwargs(options: StampOptions) -> dict:
+    # Recursos duplicados, fluxos já juntados e o carimbo substituído ficam sem
+    # referência: coleta simples (sem renumerar, os xrefs do marcador continuam valendo)
+    return {"garbage": 1} if options.compact or options.if_stamped == "replace" else {}
+
+
+def _write_subset_text(
+    page: fitz.Page,
+    lines_to_draw: list[tuple[str, float, float]],
+    font_obj: fitz.Font,
+    fontsize: float,
+    color,
+) -> None:
+    """Desenha as linhas com a fonte de arquivo embutindo só os glifos usados.
+
+    subset_fonts() age sobre todas as fontes do documento (também as do
+    PDF de entrada): o texto é escrito em uma página avulsa do tamanho da
+    CropBox, só ela é reduzida, e a página entra como XObject de
+    formulário. As fontes do documento não são tocadas.
+    """
+    cropbox = page.cropbox
+    scratch = fitz.open()
+    try:
+        # Página simples (sem CropBox nem rotação): as coordenadas são as do carimbo
+        scratch_page = scratch.new_page(width=cropbox.width, height=cropbox.height)
+        writer = fitz.TextWriter(scratch_page.rect)
+        for text, x_pos, y_pos in lines_to_draw:
+            writer.append((x_pos, y_pos), text, font=font_obj, fontsize=fontsize)
+        writer.write_text(scratch_page, color=color, render_mode=0)
+        scratch.subset_fonts()
+        inner = page.show_pdf_page(page.rect, scratch, 0)
+    finally:
+        scratch.close()
+    # show_pdf_page encaixa a página avulsa na área visível (girada, recortada);
+    # o texto comum (Shape) usa a mesma conta abaixo, sem rotação: só deslocamento
+    doc = page.parent
+    wrapper = next(x[0] for x in page.get_xobjects() if f"/fullpage {inner} 0 R" in doc.xref_object(x[0], compressed=True))
+    offset = page.cropbox_position
+    dy = page.mediabox_size.y - cropbox.height - offset.y
+    doc.xref_set_key(wrapper, "Matrix", "[1 0 0 1 %g %g]" % (offset.x, dy))
+
+
+def _stamp_document(
+    doc: fitz.Document,
+    input_pdf: str,
+    cidade: str,
+    d: date,
+    options: StampOptions,
+    started: float,
+) -> StampResult:
+    """Carimba o documento já aberto (sem salvar); started marca o início da abertura.
+
+    input_pdf serve apenas para mensagens e para localizar o Logo.jpg padrão.
+    """
+    linhas_ativas = _stamp_lines(cidade, d, options)
+    timings: dict[str, float] = {}
+    events: list[str] = []
+    t_phase = started
+    if options.page < 0 or options.page >= len(doc):
+        raise IndexError(f"Página {options.page} não existe no PDF (total {len(doc)}).")
+
+    # Verificação de carimbo anterior antes de qualquer trabalho
+    if options.if_stamped in ("skip", "replace"):
+        previous = _find_stamp(doc, options)
+        if previous is not None and options.if_stamped == "skip":
             try:
-                from PIL import Image  # type: ignore
-
-                with Image.open(logo_file) as im:
-                    im = im.convert("RGB")
-                    w_img, h_img = im.size
-                    bio = io.BytesIO()
-                    # PNG RGB SEM perfil ICC para evitar mensagens do MuPDF
-                    im.save(bio, format="PNG", icc_profile=None)
-                    data = bio.getvalue()
-
-                w_pt = options.logo_width_cm * 28.3465  # 1cm = 28.3465pt
-                h_pt = w_pt * (h_img / w_img)
-                left = options.logo_margin_cm * 28.3465
-                bottom = height - options.logo_margin_cm * 28.3465
-                rect = fitz.Rect(left, bottom - h_pt, left + w_pt, bottom)
-                page.insert_image(rect, stream=data, keep_proportion=True)
+                print(f"[data-hora-pdf] Já carimbado ({previous.source}), ignorando: {input_pdf}")
             except Exception:
-                # não interromper o carimbo se o logo falhar
                 pass
+            timings["open"] = time.perf_counter() - t_phase
+            return StampResult(
+                status="skipped",
+                page=options.page,
+                text_rect=previous.text_rect,
+                logo_rect=previous.logo_rect,
+                timings=timings,
+            )
+    else:
+        previous = None
+
+    page = doc[options.page]
+    if previous is not None and not _remove_stamp(page, previous):
+        print(f"[data-hora-pdf] Aviso: Carimbo anterior não encontrado no conteúdo da página, mantido: {input_pdf}")
+        events.append("previous_stamp_kept")
+    # Fluxos da página antes do desenho: o que aparecer depois é do carimbo.
+    # O conteúdo é isolado em q/Q antes da foto: senão o PyMuPDF faz isso no
+    # primeiro desenho e os fluxos q/Q entrariam como se fossem do carimbo.
+    if not page.is_wrapped:
+        page.wrap_contents()
+    contents_before = page.get_contents()
+    compact_before = (contents_before, _page_resources(page)) if options.compact else None
+    timings["open"] = time.perf_counter() - t_phase
+    t_phase = time.perf_counter()
 
-        # Salvar: se for o mesmo arquivo, salvar em tmp e substituir após fechar
+    # Definir posição padrão/atributos
+    fontsize = options.font_size
+    color = _parse_hex_color(options.color)
+    width, height = page.rect.width, page.rect.height
+    prepared = _prepare_text(linhas_ativas, options, height, events)
+    font_obj, fontname, font_file = prepared.font_obj, prepared.fontname, prepared.font_file
+    lines_to_draw = prepared.lines
+    used_font = fontname
+    result = StampResult(
+        status="stamped",
+        page=options.page,
+        text_rect=prepared.text_rect,
+        timings=timings,
+        events=events,
+    )
+
+    if not lines_to_draw:
         try:
-            same = Path(input_pdf).resolve() == Path(output_pdf).resolve()
+            print("[data-hora-pdf] Aviso: Nenhum texto carimbado (cidade/data desativadas).")
         except Exception:
-            same = False
-        
-        # Aplicar proteções se especificadas
-        if options.protection_password or options.restrict_editing or not options.allow_copy or options.encrypt_content:
-            # Configurar permissões
-            permissions = -1  # Todas as permissões por padrão
-            
-            if options.restrict_editing:
-                # Remove permissões de modificação
-                permissions &= ~(fitz.PDF_PERM_MODIFY | fitz.PDF_PERM_ANNOTATE | fitz.PDF_PERM_FORM)
-            
-            if not options.allow_copy:
-                # Remove permissões de cópia
-                permissions &= ~(fitz.PDF_PERM_COPY | fitz.PDF_PERM_ACCESSIBILITY)
-            
-            # Definir senhas
-            owner_password = options.protection_password or ""
-            user_password = ""  # Sem senha para abrir o documento
-            
-            # Aplicar encriptação
-            if options.encrypt_content:
-                # Usar encriptação forte
-                encrypt_method = fitz.PDF_ENCRYPT_AES_256
-            else:
-                # Usar encriptação padrão
-                encrypt_method = fitz.PDF_ENCRYPT_RC4_128
-            
-            # Configurar a proteção do documento
+            pass
+    else:
+        # Todas as linhas em uma única passada (um só fluxo de conteúdo)
+        if font_file is not None:
             try:
-                # O PyMuPDF usa a função save com parâmetros de encriptação
-                if same:
-                    target = Path(output_pdf)
-                    tmp = target.with_name(f"{target.stem}__tmp__{target.suffix}")
-                    doc.save(str(tmp), 
-                            encryption=encrypt_method,
-                            owner_pw=owner_password,
-                            user_pw=user_password,
-                            permissions=permissions)
-                    replace_plan = (tmp, target)
-                else:
-                    doc.save(output_pdf,
-                            encryption=encrypt_method,
-                            owner_pw=owner_password,
-                            user_pw=user_password,
-                            permissions=permissions)
+                _write_subset_text(page, lines_to_draw, font_obj, fontsize, color)
             except Exception as e:
-                # Fallback: salvar sem proteção se der erro
-                print(f"[data-hora-pdf] Aviso: Não foi possível aplicar proteção: {e}")
-                if same:
-                    target = Path(output_pdf)
-                    tmp = target.with_name(f"{target.stem}__tmp__{target.suffix}")
-                    doc.save(str(tmp))
-                    replace_plan = (tmp, target)
-                else:
-                    doc.save(output_pdf)
+                # Sem o subconjunto: desenha direto, com a fonte inteira
+                print(f"[data-hora-pdf] Aviso: Não foi possível reduzir a fonte embutida: {e}")
+                writer = fitz.TextWriter(page.rect)
+                for text, x_pos, y_pos in lines_to_draw:
+                    writer.append((x_pos, y_pos), text, font=font_obj, fontsize=fontsize)
+                writer.write_text(page, color=color, render_mode=0)
         else:
-            # Salvar normalmente sem proteção
-            if same:
-                target = Path(output_pdf)
-                tmp = target.with_name(f"{target.stem}__tmp__{target.suffix}")
-                doc.save(str(tmp))
-                replace_plan = (tmp, target)
-            else:
-                doc.save(output_pdf)
+            shape = page.new_shape()
+            for text, x_pos, y_pos in lines_to_draw:
+                shape.insert_text((x_pos, y_pos), text, fontsize=fontsize, fontname=fontname, fill=color, render_mode=0)
+            shape.commit()
+        # Log simples para depuração
+        try:
+            print(f"[data-hora-pdf] Fonte efetiva: {used_font} | bold={options.bold} | italic={options.italic}")
+        except Exception:
+            pass
+    result.font = used_font
+    timings["text"] = time.perf_counter() - t_phase
+    t_phase = time.perf_counter()
+
+    # Inserir logo no canto inferior esquerdo, se disponível
+    logo_file = _resolve_logo_path(options, input_pdf)
+    logo_xref, logo_kind = 0, "image"
+    if logo_file is not None:
+        # Imagens passam pelo Pillow (reamostradas, sem ICC); PDF/SVG entram como vetor
+        try:
+            logo = _prepare_logo(logo_file, options)
+            rect = _logo_rect(options, height, logo.width, logo.height)
+            logo_xref, logo_kind = _insert_logo(page, rect, logo)
+            result.logo_rect = _rect_tuple(rect)
+        except Exception:
+            # não interromper o carimbo se o logo falhar
+            events.append("logo_failure")
+    timings["logo"] = time.perf_counter() - t_phase
+
+    # Mesma conferência do plano: carimbo total ou parcialmente fora da página
+    for event, rect in (("text_outside_page", result.text_rect), ("logo_outside_page", result.logo_rect)):
+        if rect is not None and not page.rect.contains(fitz.Rect(rect)):
+            events.append(event)
+            print(f"[data-hora-pdf] Aviso: {'Texto' if event.startswith('text') else 'Logo'} do carimbo fora da página: {input_pdf}")
+
+    content_xref = 0
+    stream_xrefs: list[int] = []
+    if compact_before is not None:
+        t_phase = time.perf_counter()
+        content_xref, reused = _compact_stamp(page, *compact_before, options.consolidate_stamps)
+        logo_xref = reused.get(logo_xref, logo_xref)
+        timings["compact"] = time.perf_counter() - t_phase
+    else:
+        # Fluxos do carimbo marcados e listados no marcador (substituição sem redação)
+        stream_xrefs = [x for x in page.get_contents() if x not in contents_before]
+        for xref in stream_xrefs:
+            doc.update_stream(xref, _STAMP_TAG + b"\n" + (doc.xref_stream(xref) or b""))
+
+    # Marcador privado para detecção rápida em execuções futuras
+    _write_marker(
+        doc,
+        page,
+        result,
+        [t for t, _x, _y in lines_to_draw],
+        logo_xref,
+        logo_kind,
+        content_xref,
+        stream_xrefs,
+        Path(input_pdf).name if is_image_input(input_pdf) else None,
+    )
+
+    if options.thumbnail_px > 0:
+        # Miniatura de conferência a partir do documento já em memória (sem reabrir a saída)
+        t_phase = time.perf_counter()
+        try:
+            result.thumbnail = _render_stamp_region(page, result, options.thumbnail_px)
+        except Exception as e:
+            print(f"[data-hora-pdf] Aviso: Não foi possível gerar a miniatura de conferência: {e}")
+        timings["thumbnail"] = time.perf_counter() - t_phase
+    return result
+
+
+def stamp_pdf(
+    input_pdf: str,
+    output_pdf: str,
+    cidade: str,
+    d: date | None = None,
+    options: StampOptions | None = None,
+) -> StampResult:
+    """Carimba o PDF com "Cidade, dia de mês de ano".
+
+    - input_pdf: caminho do PDF de entrada
+    - output_pdf: caminho do PDF de saída
+    - cidade: nome da cidade
+    - d: data (padrão = hoje)
+    - options: configurações de página/posição/estilo
+
+    Retorna um StampResult; com options.if_stamped="skip" uma página já
+    carimbada é ignorada (status "skipped") e nada é gravado.
+    """
+    if options is None:
+        options = StampOptions()
+    if d is None:
+        d = date.today()
+
+    started = time.perf_counter()
+    doc, locked = _open_input(input_pdf, options.input_password)
+    replace_plan: tuple[Path, Path] | None = None
+    try:
+        encrypted = _input_encryption(doc) is not None
+        result = _stamp_document(doc, input_pdf, cidade, d, options, started)
+        if result.status == "skipped":
+            return result
+        t_phase = time.perf_counter()
+        extra = _cleanup_save_kwargs(options)
+        replace_plan = _save_protected(
+            options,
+            result.events,
+            lambda **kw: _save_document(doc, input_pdf, output_pdf, **extra, **kw),
+            encrypted,
+            _open_password(options, locked),
+        )
     finally:
         doc.close()
-        if replace_plan is not None:
-            tmp, target = replace_plan
-            try:
-                tmp.replace(target)
-            finally:
-                if tmp.exists():
-                    try:
-                        tmp.unlink()
-                    except Exception:
-                        pass
+        _apply_replace_plan(replace_plan)
+    result.timings["save"] = time.perf_counter() - t_phase
+    return result
+
+
+def stamp_pdf_bytes(
+    data: bytes,
+    cidade: str,
+    d: date | None = None,
+    options: StampOptions | None = None,
+    source: str = "",
+) -> tuple[StampResult, bytes | None]:
+    """Como stamp_pdf, mas em memória: recebe e devolve o conteúdo do PDF.
+
+    source é o caminho de origem (mensagens e Logo.jpg padrão). Devolve
+    (resultado, bytes de saída); bytes é None quando o carimbo foi ignorado.
+    """
+    if options is None:
+        options = StampOptions()
+    if d is None:
+        d = date.today()
+
+    started = time.perf_counter()
+    doc, locked = _open_bytes(data, options.input_password, source)
+    try:
+        encrypted = _input_encryption(doc) is not None
+        result = _stamp_document(doc, source, cidade, d, options, started)
+        if result.status == "skipped":
+            return result, None
+        t_phase = time.perf_counter()
+        extra = _cleanup_save_kwargs(options)
+        out = _save_protected(
+            options, result.events, lambda **kw: doc.tobytes(**extra, **kw), encrypted, _open_password(options, locked)
+        )
+    finally:
+        doc.close()
+    result.timings["save"] = time.perf_counter() - t_phase
+    return result, out